@@ -0,0 +1,48 @@
+'''
+Compares the Flask WSGI app with the ASGI serving mode (flaskr.asgi) on the
+read routes both implement. Start both against the same database, e.g.
+
+    gunicorn -w 4 'flaskr:create_app()' -b :5000
+    uvicorn flaskr.asgi:app --port 8000
+
+then run
+
+    python benchmarks/async_vs_wsgi.py --wsgi http://localhost:5000 \
+        --asgi http://localhost:8000 --concurrency 200
+'''
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+from load import format_row, run_load  # noqa: E402
+
+ENDPOINTS = [
+    ('GET', '/categories', None),
+    ('GET', '/questions?page=1', None),
+    ('GET', '/categories/1/questions', None),
+    ('POST', '/search', {'searchTerm': 'what'}),
+    ('POST', '/quizzes', {'previous_questions': [],
+                          'quiz_category': {'id': 0, 'type': 'All'}}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--wsgi', default='http://localhost:5000')
+    parser.add_argument('--asgi', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    for method, path, body in ENDPOINTS:
+        for mode, base_url in (('wsgi', args.wsgi), ('asgi', args.asgi)):
+            result = run_load(
+                base_url + path, method, body,
+                args.concurrency, args.requests
+                )
+            print(format_row(f'{mode} {method} {path}', result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------------------------------------------------------------#
+# HTTP LOAD GENERATOR
+# ----------------------------------------------------------------------------#
+'''
+Closed-loop load: `concurrency` threads issue `requests` calls in total
+against one endpoint, or against a fresh (method, path, body) drawn for each
+call, and the per-call latencies are summarised. 5xx responses count as
+errors and 4xx responses as client errors.
+'''
+
+
+def call(url, method='GET', body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(
+        url, data=data, method=method,
+        headers={'Content-Type': 'application/json'}
+        )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return time.perf_counter() - start, status
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarise(latencies, statuses, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 500),
+        'client_errors': sum(1 for status in statuses
+                             if 400 <= status < 500),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        }
+
+
+def run_calls(base_url, make_call, concurrency=10, requests=1000):
+    '''
+    Like run_load, with `make_call()` returning the (method, path, body) of
+    each request so that the load spreads over many keys.
+    '''
+    def draw_and_call(_):
+        method, path, body = make_call()
+        return call(base_url + path, method, body)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(draw_and_call, range(requests)))
+    elapsed = time.perf_counter() - start
+    return summarise(
+        [latency for latency, _ in results],
+        [status for _, status in results],
+        elapsed
+        )
+
+
+def run_load(url, method='GET', body=None, concurrency=10, requests=1000):
+    return run_calls(
+        url, lambda: (method, '', body), concurrency, requests
+        )
+
+
+def format_row(name, result):
+    return '{:<40} {:>8.1f} req/s  p50 {:>7.2f} ms  p99 {:>7.2f} ms  ' \
+        '{} errors  {} 4xx'.format(
+            name, result['throughput'], result['p50_ms'], result['p99_ms'],
+            result['errors'], result['client_errors']
+            )
@@ -0,0 +1,245 @@
+'''
+Seeds a synthetic dataset and benchmarks the read endpoints through the
+Flask test client (in process) and over HTTP with the load generator, so
+scaling regressions show up before deploy. For example
+
+    python benchmarks/suite.py --questions 100000 --categories 300
+    python benchmarks/suite.py --database postgresql://localhost/trivia_bench \
+        --questions 1000000 --http --concurrency 50 --json results.json
+
+The database is dropped and recreated on every run; never point it at one
+holding real data.
+'''
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from load import format_row, run_calls, summarise  # noqa: E402
+from flaskr import create_app  # noqa: E402
+from flaskr.bulk import import_categories, import_questions  # noqa: E402
+from models import db  # noqa: E402
+
+WORDS = ('river', 'planet', 'painter', 'war', 'king', 'element', 'novel',
+         'ocean', 'mountain', 'empire', 'album', 'team', 'island', 'bridge',
+         'language', 'desert', 'comet', 'opera', 'treaty', 'volcano')
+SEED_CHUNK_SIZE = 5000
+MEMORY_SAMPLE = 100
+
+
+# ----------------------------------------------------------------------------#
+# DATASET
+# ----------------------------------------------------------------------------#
+def synthetic_categories(count):
+    for number in range(1, count + 1):
+        yield number, {'id': number, 'type': f'Category {number}'}
+
+
+def synthetic_questions(count, categories, rng):
+    for number in range(1, count + 1):
+        first, second = rng.choice(WORDS), rng.choice(WORDS)
+        yield number, {
+            'id': number,
+            'question': f'Which {first} is known for its {second} #{number}?',
+            'answer': f'The {second} {first}',
+            'category': rng.randint(1, categories),
+            'difficulty': rng.randint(1, 5),
+            'rating': rng.randint(1, 5)
+            }
+
+
+def seed_database(database, questions, categories, rng, config=None):
+    engine = create_engine(database)
+    db.Model.metadata.drop_all(engine)
+    engine.dispose()
+
+    app = create_app(dict(config or {}, SQLALCHEMY_DATABASE_URI=database))
+    start = time.perf_counter()
+    with app.app_context():
+        import_categories(synthetic_categories(categories), SEED_CHUNK_SIZE)
+        import_questions(
+            synthetic_questions(questions, categories, rng), SEED_CHUNK_SIZE
+            )
+    return app, time.perf_counter() - start
+
+
+def warm_up(app, categories):
+    '''
+    Builds the quiz decks and payload caches, which are filled on first
+    read, so the timed runs measure steady state.
+    '''
+    client = app.test_client()
+    start = time.perf_counter()
+    for category in range(categories + 1):
+        client.get(f'/categories/{category}/questions')
+        client.post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': category, 'type': 'Any'}
+            })
+    return time.perf_counter() - start
+
+
+# ----------------------------------------------------------------------------#
+# WORKLOAD
+# ----------------------------------------------------------------------------#
+def endpoints(questions, categories, rng):
+    '''
+    (name, function returning (method, path, body)) per benchmarked route.
+    Paths are drawn per call so caches see a realistic spread of keys.
+    '''
+    pages = max(questions // 10, 1)
+    return [
+        ('GET /questions', lambda: (
+            'GET', f'/questions?page={rng.randint(1, min(pages, 100))}', None
+            )),
+        ('GET /categories/<id>/questions', lambda: (
+            'GET', f'/categories/{rng.randint(1, categories)}/questions', None
+            )),
+        ('POST /search', lambda: (
+            'POST', '/search', {'searchTerm': rng.choice(WORDS)}
+            )),
+        ('POST /quizzes', lambda: (
+            'POST', '/quizzes', {
+                'previous_questions': [],
+                'quiz_category': {'id': rng.randint(0, categories),
+                                  'type': 'Any'}
+                }
+            )),
+    ]
+
+
+def drive(client, make_call, requests):
+    latencies, statuses = [], []
+    for _ in range(requests):
+        method, path, body = make_call()
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - start)
+        statuses.append(response.status_code)
+    return latencies, statuses
+
+
+def run_client(app, make_call, requests):
+    client = app.test_client()
+    start = time.perf_counter()
+    latencies, statuses = drive(client, make_call, requests)
+    result = summarise(latencies, statuses, time.perf_counter() - start)
+
+    # tracing slows every allocation down, so measure memory separately
+    tracemalloc.start()
+    drive(client, make_call, min(requests, MEMORY_SAMPLE))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result['peak_alloc_mb'] = peak / 2 ** 20
+    return result
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_http(app, make_call, concurrency, requests):
+    server = make_server(
+        '127.0.0.1', 0, app, threaded=True,
+        request_handler=QuietRequestHandler
+        )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        return run_calls(
+            f'http://127.0.0.1:{server.server_port}', make_call,
+            concurrency, requests
+            )
+    finally:
+        server.shutdown()
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database', default=None,
+                        help='SQLAlchemy URI (default: a temporary SQLite '
+                             'file)')
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--http', action='store_true',
+                        help='also drive the routes over HTTP')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--query-budget', type=int, default=None,
+                        help='fail requests issuing more statements')
+    parser.add_argument('--row-budget', type=int, default=None,
+                        help='fail requests fetching more rows')
+    parser.add_argument('--admission', action='store_true',
+                        help='keep the per-route concurrency limits, shed '
+                             'requests count as errors')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    database = args.database
+    if database is None:
+        database = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'bench.db'
+            )
+
+    app, seed_time = seed_database(
+        database, args.questions, args.categories, rng, {
+            'QUERY_BUDGET': args.query_budget,
+            'ROW_BUDGET': args.row_budget,
+            'ENFORCE_QUERY_BUDGET': True,
+            **({} if args.admission else {'ROUTE_CONCURRENCY': None})
+            }
+        )
+    print(f'seeded {args.questions} questions in {args.categories} '
+          f'categories in {seed_time:.1f}s ({database})')
+    warm_up_time = warm_up(app, args.categories)
+    print(f'warmed up in {warm_up_time:.1f}s')
+
+    results = {
+        'database': database.split(':', 1)[0],
+        'questions': args.questions,
+        'categories': args.categories,
+        'seed_seconds': seed_time,
+        'warm_up_seconds': warm_up_time,
+        'routes': {},
+        }
+    for name, make_call in endpoints(args.questions, args.categories, rng):
+        route = results['routes'][name] = {}
+        route['client'] = run_client(app, make_call, args.requests)
+        print(format_row(f'client {name}', route['client'])
+              + f"  peak {route['client']['peak_alloc_mb']:.1f} MB")
+        if args.http:
+            route['http'] = run_http(
+                app, make_call, args.concurrency, args.requests
+                )
+            print(format_row(f'http {name}', route['http']))
+
+    results['max_rss_mb'] = max_rss_mb()
+    print(f"max RSS {results['max_rss_mb']:.1f} MB")
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,28 +2,291 @@
 # IMPORTS
 # ----------------------------------------------------------------------------#
 import os
-from flask import Flask, request, abort, jsonify
+import base64
+from flask import (
+    Flask, Response, request, abort, jsonify, stream_with_context
+)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
+from sqlalchemy import and_, func, or_, tuple_
 from werkzeug.exceptions import HTTPException
-from models import setup_db, Question, Category
+from models import (
+    setup_db, migrate_db, database_path, db, Question, QuestionRow, Category,
+    CategoryStats, QuestionStats
+)
+from .admission import AdmissionControl
+from .budget import QueryBudget
+from .bulk import (
+    BulkImportError, CATEGORY_FIELDS, QUESTION_FIELDS, export_rows,
+    import_categories, import_questions, read_rows
+)
+from .cache import CategoryCache, LocalStore
+from .coalesce import SingleFlight, coalesce
+from .compress import Compressor
+from .conditional import conditional
+from .decks import QuizDecks
+from .metrics import Metrics
+from .payloads import (
+    QuestionPayloads, RawJSON, json_response, json_stream
+)
+from .quiz import QuizSessions
+from .replicas import ReadRouting
+from .search import create_search_index
+from .stats import AnswerStats
 
 # ----------------------------------------------------------------------------#
 # PAGINATION
 # ----------------------------------------------------------------------------#
 QUESTIONS_PER_PAGE = 10
+MAX_QUIZ_QUESTIONS = 50
+STREAM_BATCH_SIZE = 500
 
 
-def paginate_questions(request, selection):
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode(str(question_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that was not produced by encode_cursor
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+
+def page_window(request):
+    '''
+    Returns (after, offset) for the request: the question id decoded from
+    `?after=<cursor>`, or the LIMIT/OFFSET start of `?page=<n>`.
+    '''
+    after = request.args.get('after', None, type=str)
+    if after is not None:
+        return decode_cursor(after), 0
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    return None, max(page - 1, 0) * QUESTIONS_PER_PAGE
+
+
+SORT_COLUMNS = {
+    'id': Question.id,
+    'difficulty': Question.difficulty,
+    'rating': Question.rating,
+}
+ID_ORDER = (Question.id, False)
+
+
+def encode_sort_cursor(value, question_id):
+    # a NULL sort value is encoded as an empty value
+    return encode_cursor(f"{'' if value is None else value}:{question_id}")
+
+
+def decode_sort_cursor(cursor, convert=int):
+    value, question_id = base64.urlsafe_b64decode(
+        cursor.encode()
+        ).decode().split(':')
+    return convert(value) if value else None, int(question_id)
+
+
+def search_window(request):
+    '''
+    Like page_window, except that `?after=<cursor>` holds the (rank, id) of
+    the last search result of the previous page.
+    '''
+    after = request.args.get('after', None, type=str)
+    if after is not None:
+        return decode_sort_cursor(after, float), 0
+    return page_window(request)
+
+
+def question_filters(request, selection):
+    '''
+    Narrows `selection` with `?difficulty=<n>` and `?min_rating=<n>`.
+    Returns (selection, whether any filter was applied); malformed values
+    raise ValueError.
+    '''
+    difficulty = request.args.get('difficulty', None)
+    min_rating = request.args.get('min_rating', None)
+    if difficulty is not None:
+        selection = selection.filter(Question.difficulty == int(difficulty))
+    if min_rating is not None:
+        selection = selection.filter(Question.rating >= int(min_rating))
+    return selection, difficulty is not None or min_rating is not None
+
+
+def question_order(request):
+    '''
+    Returns (column, descending) for `?sort=[-]<id|difficulty|rating>`,
+    ties broken on Question.id in the same direction.
+    '''
+    sort = request.args.get('sort', 'id')
+    column = SORT_COLUMNS.get(sort.lstrip('-'))
+    if column is None:
+        raise ValueError(f'Unsupported sort: {sort}')
+    return column, sort.startswith('-')
+
+
+def sort_keys(column, descending):
+    '''
+    NULLs of a sort column order after every value, as in a Postgres
+    (column, id) index, so both directions can be read from it.
+    '''
+    if column is Question.id:
+        return [Question.id.desc() if descending else Question.id]
+    if descending:
+        return [column.desc().nullsfirst(), Question.id.desc()]
+    return [column.asc().nullslast(), Question.id]
+
+
+def sort_position(column, descending, value, question_id):
+    '''
+    Filter for the rows after (value, id) in the sort order; the row value
+    comparison never matches NULLs, so they are paged explicitly.
+    '''
+    if value is None:
+        after_id = (Question.id < question_id if descending
+                    else Question.id > question_id)
+        in_nulls = and_(column.is_(None), after_id)
+        return or_(in_nulls, column.isnot(None)) if descending else in_nulls
+
+    position, after = tuple_(column, Question.id), tuple_(value, question_id)
+    if descending:
+        return position < after
+    return or_(position > after, column.is_(None))
+
+
+def page_cursor(request, order=ID_ORDER):
+    '''
+    Decodes `?after=<cursor>` for `order`: the id of the last question, or
+    its (sort value, id) when sorting on another column. Returns None without
+    a cursor; malformed cursors raise ValueError.
+    '''
+    cursor = request.args.get('after', None, type=str)
+    if cursor is None:
+        return None
+    if order[0] is Question.id:
+        return decode_cursor(cursor)
+    return decode_sort_cursor(cursor)
+
+
+def page_selection(request, selection, order=ID_ORDER):
+    '''
+    Pushes the ordering and page window of the `selection` query into the
+    database. `?after=<cursor>` selects keyset mode on (sort column, id),
+    otherwise `?page=<n>` is translated into LIMIT/OFFSET.
+    '''
+    column, descending = order
+    selection = selection.order_by(None).order_by(
+        *sort_keys(column, descending)
+        )
+
+    after = page_cursor(request, order)
+    if after is None:
+        _, offset = page_window(request)
+        return selection.offset(offset).limit(QUESTIONS_PER_PAGE)
+
+    if column is Question.id:
+        position = Question.id < after if descending else Question.id > after
+    else:
+        position = sort_position(column, descending, *after)
+    return selection.filter(position).limit(QUESTIONS_PER_PAGE)
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
 
-    return current_questions
+def paginate_questions(request, selection, order=ID_ORDER):
+    return [
+        question.format() for question in QuestionRow.all(
+            page_selection(request, QuestionRow.project(selection), order)
+            )
+        ]
+
+
+def paginate_question_ids(request, selection, order=ID_ORDER):
+    '''
+    Returns (ids of the page, cursor of the next page or None).
+    '''
+    column = order[0]
+    if column is Question.id:
+        rows = page_selection(
+            request, selection.with_entities(Question.id), order
+            ).all()
+        question_ids = [question_id for question_id, in rows]
+        return question_ids, next_cursor(question_ids)
+
+    rows = page_selection(
+        request, selection.with_entities(Question.id, column), order
+        ).all()
+    question_ids = [question_id for question_id, _ in rows]
+    if len(rows) < QUESTIONS_PER_PAGE:
+        return question_ids, None
+    question_id, value = rows[-1]
+    return question_ids, encode_sort_cursor(value, question_id)
+
+
+def next_cursor(question_ids):
+    if len(question_ids) < QUESTIONS_PER_PAGE:
+        return None
+    return encode_cursor(question_ids[-1])
+
+
+# ----------------------------------------------------------------------------#
+# RANDOM SELECTION
+# ----------------------------------------------------------------------------#
+def random_question(selection, total, previous_questions):
+    '''
+    Picks a random question from `selection` without loading the candidates.
+    The eligible count is the maintained `total` minus the previous questions
+    that fall inside the selection (primary key lookups), and a random OFFSET
+    into the id ordered selection fetches the single row.
+    '''
+    if previous_questions:
+        total -= selection.filter(
+            Question.id.in_(previous_questions)
+            ).order_by(None).count()
+        selection = selection.filter(Question.id.notin_(previous_questions))
+    if total <= 0:
+        return None
+
+    selection = QuestionRow.project(selection).order_by(Question.id)
+    # a counter that lags a concurrent delete can overshoot by a row or two
+    return (QuestionRow.first(selection.offset(random.randrange(total)))
+            or QuestionRow.first(selection))
+
+
+def random_questions(selection, previous_questions, count):
+    '''
+    Picks `count` distinct random questions from `selection` in a single
+    pass: the eligible rows are ordered by random() and the first `count`
+    are read.
+    '''
+    if previous_questions:
+        selection = selection.filter(Question.id.notin_(previous_questions))
+    return QuestionRow.all(
+        QuestionRow.project(selection).order_by(func.random()).limit(count)
+        )
+
+
+def draw_questions(quiz_decks, category_id, previous_questions, count):
+    '''
+    Serves up to `count` random questions from the precomputed deck of the
+    category with a single primary key IN lookup.
+    '''
+    excluded = list(previous_questions)
+    questions = []
+    while len(questions) < count:
+        question_ids = quiz_decks.draw_many(
+            category_id, excluded, count - len(questions)
+            )
+        if not question_ids:
+            break
+        loaded = {
+            question.id: question for question in QuestionRow.all(
+                QuestionRow.query().filter(Question.id.in_(question_ids))
+                )
+            }
+        for question_id in question_ids:
+            if question_id in loaded:
+                questions.append(loaded[question_id])
+            else:
+                # deleted by another worker since the deck was built
+                quiz_decks.remove(question_id)
+        excluded += question_ids
+    return questions
 
 
 # ----------------------------------------------------------------------------#
@@ -32,7 +295,122 @@ def paginate_questions(request, selection):
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(
+        SQLALCHEMY_DATABASE_URI=database_path,
+        CACHE_STORE=None,
+        CATEGORY_CACHE_TTL=300,
+        HTTP_CACHE_MAX_AGE=0,
+        LEAN_WRITE_RESPONSES=False,
+        BULK_CHUNK_SIZE=1000,
+        QUIZ_SESSION_TTL=3600,
+        QUIZ_SESSION_MAX_SIZE=MAX_QUIZ_QUESTIONS,
+        QUIZ_DECKS=True,
+        QUIZ_DECK_REFRESH=300,
+        PAYLOAD_CACHE_SIZE=10000,
+        METRICS=True,
+        QUERY_BUDGET=None,
+        ROW_BUDGET=None,
+        SLOW_QUERY_MS=500,
+        ENFORCE_QUERY_BUDGET=False,
+        COMPRESS_MIN_SIZE=1024,
+        COMPRESS_LEVEL=6,
+        REPLICA_STICKY_SECONDS=5,
+        STATS_FLUSH_INTERVAL=5,
+        STATS_FLUSH_SIZE=1000,
+        COALESCE_READS=True,
+        COALESCE_TIMEOUT=10,
+        ROUTE_CONCURRENCY={'search_questions': 8, 'play_quiz': 16},
+        RATE_LIMIT=None,
+        RATE_LIMIT_BURST=None,
+    )
+    if test_config is not None:
+        app.config.update(test_config)
+
+    setup_db(app, app.config['SQLALCHEMY_DATABASE_URI'])
+
+    @app.cli.command('migrate-db')
+    def migrate_db_command():
+        '''
+        One-off schema migrations for databases that predate the current
+        models, run once per deploy instead of at every worker's startup.
+        '''
+        migrate_db()
+
+    search_index = create_search_index(db.engine)
+    store = app.config['CACHE_STORE'] or LocalStore()
+    category_cache = CategoryCache(store, app.config['CATEGORY_CACHE_TTL'])
+    quiz_sessions = QuizSessions(
+        store, app.config['QUIZ_SESSION_TTL'],
+        app.config['QUIZ_SESSION_MAX_SIZE']
+        )
+    question_payloads = QuestionPayloads(
+        db.engine, app.config['PAYLOAD_CACHE_SIZE']
+        )
+    quiz_decks = app.extensions['quiz_decks'] = QuizDecks(
+        db.engine, app.config['QUIZ_DECK_REFRESH']
+        ) if app.config['QUIZ_DECKS'] else None
+    single_flight = SingleFlight(
+        app.config['COALESCE_TIMEOUT']
+        ) if app.config['COALESCE_READS'] else None
+    answer_stats = app.extensions['answer_stats'] = AnswerStats(
+        app, app.config['STATS_FLUSH_INTERVAL'],
+        app.config['STATS_FLUSH_SIZE']
+        )
+    # registered first so rejected requests skip the other hooks
+    admission = AdmissionControl(
+        app, app.config['ROUTE_CONCURRENCY'] or {},
+        rate=app.config['RATE_LIMIT'], burst=app.config['RATE_LIMIT_BURST']
+        )
+    # registered first so it runs after the other after_request hooks
+    if app.config['COMPRESS_MIN_SIZE'] is not None:
+        Compressor(
+            app, app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_LEVEL']
+            )
+    engines = [db.engine] + app.extensions['read_replicas']
+    QueryBudget(
+        app, engines,
+        max_queries=app.config['QUERY_BUDGET'],
+        max_rows=app.config['ROW_BUDGET'],
+        slow_query_ms=app.config['SLOW_QUERY_MS'],
+        enforce=app.config['ENFORCE_QUERY_BUDGET']
+        )
+    if app.extensions['read_replicas']:
+        ReadRouting(
+            app, app.extensions['read_replicas'],
+            app.config['REPLICA_STICKY_SECONDS'],
+            # answer reports are buffered, they do not write to the primary
+            ['search_questions', 'play_quiz', 'start_quiz_session',
+             'next_quiz_question', 'report_answers']
+            )
+    metrics = None
+    if app.config['METRICS']:
+        metrics = Metrics(app, engines)
+        metrics.register_cache('categories', category_cache)
+        metrics.register_cache('question_payloads', question_payloads)
+        if single_flight is not None:
+            metrics.register_counter(
+                'trivia_coalesced_requests_total',
+                'Requests answered with the result of an identical request '
+                'already in flight', 'route',
+                lambda: dict(single_flight.coalesced)
+                )
+        metrics.register_counter(
+            'trivia_throttled_requests_total',
+            'Requests rejected with 429 by the per-client rate limit',
+            'route', lambda: dict(admission.throttled)
+            )
+        metrics.register_counter(
+            'trivia_shed_requests_total',
+            'Requests rejected with 503 by the per-route concurrency limit',
+            'route', lambda: dict(admission.shed)
+            )
+        pool_metrics = app.extensions['pool_metrics']
+        for name in ('connects', 'checkouts', 'checked_out',
+                     'peak_checked_out'):
+            metrics.register_gauge(
+                f'trivia_db_pool_{name}', f'Connection pool {name}',
+                lambda name=name: getattr(pool_metrics, name)
+                )
     '''
     CORS. Allow '*' for origins.
     '''
@@ -47,6 +425,32 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods',
                              'GET, PATCH, POST, DELETE, OPTIONS')
         return response
+    '''
+    Lean write responses return only the created/deleted entity and the
+    maintained totals instead of re-listing the table. Enabled for every
+    write with LEAN_WRITE_RESPONSES, or per request with `?lean=true`.
+    '''
+    def lean_response():
+        lean = request.args.get('lean', None)
+        if lean is None:
+            return app.config['LEAN_WRITE_RESPONSES']
+        return lean.lower() in ('1', 'true', 'yes')
+
+    '''
+    Bulk uploads are NDJSON, or CSV with a header row when sent as text/csv.
+    Exports stream `?format=ndjson` (default) or `?format=csv`.
+    '''
+    EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def export_response(model, fields):
+        output_format = request.args.get('format', 'ndjson')
+        if output_format not in EXPORT_MIMETYPES:
+            abort(400, f'Unsupported export format: {output_format}')
+        return Response(
+            stream_with_context(export_rows(model, fields, output_format)),
+            mimetype=EXPORT_MIMETYPES[output_format]
+            )
+
     # ----------------------------------------------------------------------------#
     # CATEGORIES
     # ----------------------------------------------------------------------------#
@@ -65,14 +469,20 @@ def create_app(test_config=None):
             category = Category(type=category_type)
             category.insert()
 
-            categories = Category.query.all()
+            if lean_response():
+                return jsonify({
+                    'success': True,
+                    'created': category.id,
+                    'category': category.format(),
+                    'total_categories': Category.count()
+                    })
+
+            categories = category_cache.categories()
 
             return jsonify({
                 'success': True,
                 'created': category.id,
-                'categories': {
-                    category.id: category.type for category in categories
-                },
+                'categories': categories,
                 'total_categories': len(categories)
                 })
         except Exception:
@@ -81,15 +491,15 @@ def create_app(test_config=None):
     # Read
     # ----------------------------------------------------------------------------#
     @app.route('/categories', methods=['GET'])
+    @conditional('categories')
+    @coalesce(single_flight)
     def get_categories():
-        categories = Category.query.all()
-        if len(categories) == 0:
+        categories = category_cache.serialized()
+        if categories == b'{}':
             return abort(404, 'Categories not found')
-        return jsonify({
-          'success': True,
-          'categories': {
-            category.id: category.type for category in categories
-            }
+        return json_response({
+            'success': True,
+            'categories': RawJSON(categories)
         })
 
     # Delete
@@ -104,7 +514,17 @@ def create_app(test_config=None):
                 return abort(404, f'Category with id:{category_id} not found')
 
             category.delete()
-            categories = Category.query.all()
+            if quiz_decks is not None:
+                quiz_decks.invalidate(category_id)
+
+            if lean_response():
+                return jsonify({
+                    'success': True,
+                    'deleted': category_id,
+                    'total_categories': Category.count()
+                    })
+
+            categories = category_cache.categories()
 
             return jsonify({
                 'success': True,
@@ -116,24 +536,58 @@ def create_app(test_config=None):
         except Exception:
             return abort(404, f'Category with id:{category_id} not found')
 
+    # Bulk
+    # ----------------------------------------------------------------------------#
+    @app.route('/categories/import', methods=['POST'])
+    def import_category_rows():
+        try:
+            imported = import_categories(
+                read_rows(request.stream, request.mimetype),
+                app.config['BULK_CHUNK_SIZE']
+                )
+        except BulkImportError as error:
+            abort(422, str(error))
+
+        return jsonify({
+            'success': True,
+            'imported': imported,
+            'total_categories': Category.count()
+            })
+
+    @app.route('/categories/export', methods=['GET'])
+    def export_categories():
+        return export_response(Category, CATEGORY_FIELDS)
+
     # Search by Category
     # ----------------------------------------------------------------------------#
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @conditional('questions')
+    @coalesce(single_flight)
     def get_questions_by_category(category_id):
         try:
-            selection = Question.query.filter(
-                Question.category == str(category_id)
-                ).all()
-            current_questions = paginate_questions(request, selection)
+            selection, filtered = question_filters(
+                request,
+                Question.query.filter(Question.category == category_id)
+                )
+            order = question_order(request)
+            page_cursor(request, order)
+        except ValueError:
+            abort(422, 'unprocessable')
+        try:
+            question_ids, cursor = paginate_question_ids(
+                request, selection, order
+                )
 
-            if len(current_questions) == 0:
+            if len(question_ids) == 0:
                 return abort(422, "unprocessable")
 
-            return jsonify({
+            return json_response({
                 'success': True,
-                'questions': current_questions,
-                'total_questions': len(selection),
-                'current_category': category_id
+                'questions': question_payloads.array(question_ids),
+                'total_questions': (selection.count() if filtered
+                                    else Question.count(category_id)),
+                'current_category': category_id,
+                'next_cursor': cursor
             })
 
         except Exception:
@@ -159,13 +613,23 @@ def create_app(test_config=None):
         try:
             question = Question(
                 question=question, answer=answer,
-                category=category, difficulty=difficulty,
+                category=int(category), difficulty=difficulty,
                 rating=rating
                 )
             question.insert()
 
-            selection = Question.query.order_by(Question.category).all()
-            current_questions = paginate_questions(request, selection)
+            if lean_response():
+                return jsonify({
+                    'success': True,
+                    'created': question.id,
+                    'question': question.format(),
+                    'total_question': Question.count()
+                    })
+
+            # page_selection replaces any order_by on the selection
+            current_questions = paginate_questions(
+                request, Question.query, (Question.category, False)
+                )
             if len(current_questions) == 0:
                 return abort(422, "unprocessable")
 
@@ -173,7 +637,7 @@ def create_app(test_config=None):
                 'success': True,
                 'created': question.id,
                 'questions': current_questions,
-                'total_question': len(Question.query.all())
+                'total_question': Question.count()
                 })
         except Exception:
             return abort(422, "unprocessable")
@@ -181,26 +645,35 @@ def create_app(test_config=None):
     # Read
     # ----------------------------------------------------------------------------#
     @app.route('/questions', methods=['GET'])
+    @conditional('questions', 'categories')
+    @coalesce(single_flight)
     def get_questions():
-        selection = Question.query.order_by(Question.id).all()
         try:
-            current_questions = paginate_questions(request, selection)
-            if len(current_questions) == 0:
+            selection, filtered = question_filters(request, Question.query)
+            order = question_order(request)
+            page_cursor(request, order)
+        except ValueError:
+            abort(422, 'unprocessable')
+        try:
+            question_ids, cursor = paginate_question_ids(
+                request, selection, order
+                )
+            if len(question_ids) == 0:
                 return abort(422, "unprocessable")
 
-            categories = Category.query.all()
+            categories = category_cache.serialized()
 
-            if len(categories) == 0:
+            if categories == b'{}':
                 return abort(404, 'Categories not found')
 
-            return jsonify({
+            return json_response({
                 'success': True,
-                'questions': current_questions,
-                'total_questions': len(Question.query.all()),
+                'questions': question_payloads.array(question_ids),
+                'total_questions': (selection.count() if filtered
+                                    else Question.count()),
                 'current_category': None,
-                'categories': {
-                    category.id: category.type for category in categories
-                    }
+                'categories': RawJSON(categories),
+                'next_cursor': cursor
                 })
         except Exception:
             abort(404, 'Questions not found')
@@ -216,7 +689,15 @@ def create_app(test_config=None):
             return abort(404, f'Question with id:{question_id} not found')
         try:
             question.delete()
-            selection = Question.query.order_by(Question.id).all()
+
+            if lean_response():
+                return jsonify({
+                    'success': True,
+                    'deleted': question_id,
+                    'total_questions': Question.count()
+                    })
+
+            selection = Question.query.order_by(Question.id)
             current_questions = paginate_questions(request, selection)
 
             if len(current_questions) == 0:
@@ -226,11 +707,37 @@ def create_app(test_config=None):
                 'success': True,
                 'deleted': question_id,
                 'questions': current_questions,
-                'total_questions': len(Question.query.all())
+                'total_questions': Question.count()
                 })
         except Exception:
             return abort(500)
 
+    # Bulk
+    # ----------------------------------------------------------------------------#
+    @app.route('/questions/import', methods=['POST'])
+    def import_question_rows():
+        try:
+            imported = import_questions(
+                read_rows(request.stream, request.mimetype),
+                app.config['BULK_CHUNK_SIZE']
+                )
+        except BulkImportError as error:
+            abort(422, str(error))
+        finally:
+            search_index.invalidate()
+            if quiz_decks is not None:
+                quiz_decks.invalidate()
+
+        return jsonify({
+            'success': True,
+            'imported': imported,
+            'total_questions': Question.count()
+            })
+
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions():
+        return export_response(Question, QUESTION_FIELDS)
+
     # Search by text
     # ----------------------------------------------------------------------------#
     @app.route('/search', methods=['POST'])
@@ -241,72 +748,231 @@ def create_app(test_config=None):
         body = request.get_json()
         search_term = body.get('searchTerm', None)
 
-        selection = Question.query.filter(
-            Question.question.ilike('%{}%'.format(search_term))
-            ).all()
+        if request.args.get('stream', 'false').lower() in ('1', 'true', 'yes'):
+            total_questions, rows = search_index.stream(
+                search_term, STREAM_BATCH_SIZE
+                )
+            if total_questions == 0:
+                abort(404, 'Question not found')
+            return json_stream({
+                'success': True,
+                'total_questions': total_questions
+                }, 'questions', rows, STREAM_BATCH_SIZE)
+
+        try:
+            after, offset = search_window(request)
+        except ValueError:
+            abort(422, 'unprocessable')
+        page, total_questions = search_index.search(
+            search_term, after, offset, QUESTIONS_PER_PAGE
+            )
 
-        if not selection:
+        if total_questions == 0:
             abort(404, 'Question not found')
 
-        current_questions = paginate_questions(request, selection)
-        if len(current_questions) == 0:
+        if len(page) == 0:
             return abort(422, "unprocessable")
 
-        return jsonify({
+        # ranked pages continue after the (rank, id) of their last row
+        cursor = None
+        if len(page) == QUESTIONS_PER_PAGE:
+            question_id, rank = page[-1]
+            cursor = encode_sort_cursor(rank, question_id)
+
+        return json_response({
                 'success': True,
-                'questions': current_questions,
-                'total_questions': len(current_questions)
+                'questions': question_payloads.array(
+                    [question_id for question_id, _ in page]
+                    ),
+                'total_questions': total_questions,
+                'next_cursor': cursor
             })
 
     # ----------------------------------------------------------------------------#
     # QUIZ
     # ----------------------------------------------------------------------------#
     @app.route('/quizzes', methods=['POST'])
+    @coalesce(single_flight)
     def play_quiz():
         try:
             body = request.get_json()
             quiz_category = body.get('quiz_category', None)
-            previous_questions = body.get('previous_questions', None)
-
-            if quiz_category['id'] == 0:
-                if previous_questions is None:
-                    questions = Question.query.all()
-                else:
-                    questions = Question.query.filter(
-                        Question.id.notin_(previous_questions)
-                        ).all()
-
-            elif quiz_category['id'] != 0:
-                if previous_questions is None:
-                    questions = Question.query.filter(
-                        Question.category == quiz_category['id']
-                        ).all()
+            previous_questions = body.get('previous_questions', None) or []
+            category_id = int(quiz_category['id'])
+            count = int(body.get('count', 1))
+            if not 1 <= count <= MAX_QUIZ_QUESTIONS:
+                abort(422)
+
+            if quiz_decks is not None:
+                questions = draw_questions(
+                    quiz_decks, category_id, previous_questions, count
+                    )
+            else:
+                selection = Question.query
+                if category_id != 0:
+                    selection = selection.filter(
+                        Question.category == category_id
+                        )
+                if count > 1:
+                    questions = random_questions(
+                        selection, previous_questions, count
+                        )
                 else:
-                    questions = Question.query.filter(
-                        Question.category == quiz_category['id'],
-                        Question.id.notin_(previous_questions)
-                        ).all()
+                    question = random_question(
+                        selection, Question.count(category_id or None),
+                        previous_questions
+                        )
+                    questions = [question] if question else []
 
-            question = random.choice(questions) if len(questions) > 0 else []
-
-            return jsonify({
+            response = {
                 'success': True,
-                'question': question.format()
-            })
+                'question': questions[0].format() if questions else None
+            }
+            if 'count' in body:
+                response['questions'] = [q.format() for q in questions]
+            return jsonify(response)
 
         except Exception:
             return abort(422, "unprocessable")
 
+    # Sessions
+    # ----------------------------------------------------------------------------#
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        try:
+            body = request.get_json()
+            category_id = int(body['quiz_category']['id'])
+            size = body.get('size', None)
+
+            if quiz_decks is not None:
+                question_ids = quiz_decks.deck(category_id)
+            else:
+                selection = db.session.query(Question.id)
+                if category_id != 0:
+                    selection = selection.filter(
+                        Question.category == category_id
+                        )
+                question_ids = [question_id for question_id, in selection]
+
+            token, total = quiz_sessions.start(question_ids, size)
+        except Exception:
+            return abort(422, "unprocessable")
+
+        return jsonify({
+            'success': True,
+            'session': token,
+            'total_questions': total
+        })
+
+    @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+    def next_quiz_question(token):
+        while True:
+            try:
+                question_id, remaining = quiz_sessions.next(token)
+            except KeyError:
+                return abort(404, 'Quiz session not found')
+            question = (QuestionRow.get(question_id)
+                        if question_id is not None else None)
+            # questions deleted since the session started are skipped
+            if question is not None or question_id is None:
+                break
+
+        return jsonify({
+            'success': True,
+            'question': question.format() if question else None,
+            'remaining': remaining
+        })
+
+    @app.route('/quizzes/sessions/<token>', methods=['DELETE'])
+    def finish_quiz_session(token):
+        try:
+            answered = quiz_sessions.finish(token)
+        except KeyError:
+            return abort(404, 'Quiz session not found')
+
+        return jsonify({
+            'success': True,
+            'finished': token,
+            'answered': answered
+        })
+
+    # Answers
+    # ----------------------------------------------------------------------------#
+    @app.route('/quizzes/answers', methods=['POST'])
+    def report_answers():
+        body = request.get_json()
+        try:
+            answers = [
+                (int(answer['question_id']), bool(answer['correct']))
+                for answer in body.get('answers', [body])
+                ]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            answers = []
+        if not answers:
+            return abort(400, 'Required object keys missing from request')
+
+        answer_stats.record(answers)
+        return jsonify({
+            'success': True,
+            'recorded': len(answers)
+        }), 202
+
+    @app.route('/questions/<int:question_id>/stats', methods=['GET'])
+    def get_question_stats(question_id):
+        stats = QuestionStats.query.get(question_id)
+        if stats is None:
+            if QuestionRow.get(question_id) is None:
+                return abort(
+                    404, f'Question with id:{question_id} not found'
+                    )
+            stats = QuestionStats(question_id=question_id, plays=0, correct=0)
+
+        return jsonify({
+            'success': True,
+            'stats': stats.format()
+        })
+
+    @app.route('/categories/stats', methods=['GET'])
+    def get_category_stats():
+        stats = CategoryStats.query.order_by(CategoryStats.category_id).all()
+        return jsonify({
+            'success': True,
+            'stats': [category_stats.format() for category_stats in stats]
+        })
+
+    # ----------------------------------------------------------------------------#
+    # HEALTH
+    # ----------------------------------------------------------------------------#
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({
+            'success': True,
+            'pool': app.extensions['pool_metrics'].status()
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        if metrics is None:
+            abort(404, 'Metrics are disabled')
+        return Response(
+            metrics.render(), mimetype='text/plain; version=0.0.4'
+            )
+
     # ----------------------------------------------------------------------------#
     # ERROR HANDLERS
     # ----------------------------------------------------------------------------#
     @app.errorhandler(HTTPException)
     def http_exception_handler(error):
-        return jsonify({
+        response = jsonify({
           'success': False,
           'error': error.code,
           'message': error.description
-          }), error.code
+          })
+        # 429 and 503 from admission control tell the client when to retry
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        return response, error.code
 
     @app.errorhandler(Exception)
     def exception_handler(error):
@@ -0,0 +1,98 @@
+import math
+import threading
+import time
+from collections import Counter as Tally, OrderedDict
+
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+# ----------------------------------------------------------------------------#
+# ADMISSION CONTROL
+# ----------------------------------------------------------------------------#
+'''
+Rejects requests before they reach a handler when the server is saturated.
+Routes listed in `route_limits` may only run that many requests at once per
+process; the rest fail immediately with 503 instead of queueing for a
+worker, so a burst of searches cannot starve the cheap endpoints. With a
+`rate`, each client (by remote address) also gets a token bucket of `burst`
+requests refilled at `rate` per second, and fails with 429 when it is
+empty. Both carry a Retry-After header.
+'''
+MAX_CLIENTS = 10000
+EXEMPT_ENDPOINTS = {'health', 'get_metrics'}
+SHED_RETRY_AFTER = 1
+
+
+class TokenBuckets:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        # least recently seen clients first, they are evicted first
+        self.buckets = OrderedDict()
+
+    def take(self, client):
+        '''
+        Returns 0 when `client` may proceed, otherwise the seconds until its
+        next token.
+        '''
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[client] = (tokens, now)
+            while len(self.buckets) > MAX_CLIENTS:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionControl:
+
+    def __init__(self, app, route_limits, rate=None, burst=None):
+        self.slots = {
+            endpoint: threading.BoundedSemaphore(limit)
+            for endpoint, limit in route_limits.items()
+            }
+        self.buckets = TokenBuckets(
+            rate, burst or max(1, math.ceil(rate))
+            ) if rate else None
+        self.throttled = Tally()
+        self.shed = Tally()
+
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+
+    def admit(self):
+        if (request.method == 'OPTIONS'
+                or request.endpoint in EXEMPT_ENDPOINTS):
+            return
+
+        if self.buckets is not None:
+            wait = self.buckets.take(request.remote_addr)
+            if wait:
+                self.throttled[request.endpoint] += 1
+                raise TooManyRequests(
+                    'Rate limit exceeded', retry_after=math.ceil(wait)
+                    )
+
+        slot = self.slots.get(request.endpoint)
+        if slot is None:
+            return
+        if not slot.acquire(blocking=False):
+            self.shed[request.endpoint] += 1
+            raise ServiceUnavailable(
+                'Server busy, try again shortly',
+                retry_after=SHED_RETRY_AFTER
+                )
+        g.admission_slot = slot
+
+    def release(self, error=None):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            slot.release()
@@ -0,0 +1,374 @@
+import json
+import os
+import random
+import re
+from urllib.parse import parse_qs
+
+try:
+    import asyncpg
+except ImportError:  # optional dependency, only needed for this module
+    asyncpg = None
+
+from models import database_path
+from . import (
+    MAX_QUIZ_QUESTIONS, QUESTIONS_PER_PAGE, decode_cursor,
+    decode_sort_cursor, encode_sort_cursor, next_cursor
+)
+from .search import SEARCH_DOCUMENT, tokenize
+
+# ----------------------------------------------------------------------------#
+# ASGI SERVING MODE
+# ----------------------------------------------------------------------------#
+'''
+Optional asyncio implementation of the read routes (categories, questions,
+search and quizzes) on an asyncpg pool, so one process can multiplex many
+concurrent players instead of blocking a worker per database round-trip.
+Responses match the Flask app; writes, bulk endpoints and the caches stay on
+the WSGI app, which can run next to it against the same Postgres database.
+
+    pip install asyncpg uvicorn
+    uvicorn flaskr.asgi:app
+'''
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty, rating'
+# filters and orders of the Flask list routes that are not implemented here
+UNSUPPORTED_LIST_ARGS = ('difficulty', 'min_rating', 'sort')
+
+
+class HTTPError(Exception):
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class Request:
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {
+            key: values[0]
+            for key, values in parse_qs(scope['query_string'].decode()).items()
+            }
+        self.body = body
+
+    def get_json(self):
+        if not self.body:
+            raise HTTPError(422, 'unprocessable')
+        return json.loads(self.body)
+
+    def reject_unsupported(self):
+        '''
+        Fails with 400 instead of answering in id order without the filter.
+        '''
+        unsupported = [
+            key for key in UNSUPPORTED_LIST_ARGS
+            if key in self.args and (key, self.args[key]) != ('sort', 'id')
+            ]
+        if unsupported:
+            raise HTTPError(
+                400, 'Not supported in ASGI mode: ' + ', '.join(unsupported)
+                )
+
+    def page_window(self, decode=decode_cursor):
+        if 'after' in self.args:
+            return decode(self.args['after']), 0
+        try:
+            page = int(self.args.get('page', 1))
+        except ValueError:
+            page = 1
+        return None, max(page - 1, 0) * QUESTIONS_PER_PAGE
+
+
+class TriviaApp:
+
+    def __init__(self, dsn, pool_size):
+        if asyncpg is None:
+            raise RuntimeError('The ASGI serving mode requires asyncpg')
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.pool = None
+        self.routes = [
+            ('GET', re.compile(r'^/categories$'), self.get_categories),
+            ('GET', re.compile(r'^/questions$'), self.get_questions),
+            ('GET', re.compile(r'^/categories/(\d+)/questions$'),
+             self.get_questions_by_category),
+            ('POST', re.compile(r'^/search$'), self.search_questions),
+            ('POST', re.compile(r'^/quizzes$'), self.play_quiz),
+        ]
+
+    # Protocol
+    # ------------------------------------------------------------------------#
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        request = Request(scope, body)
+        try:
+            status, payload = 200, await self.dispatch(request)
+        except HTTPError as error:
+            status, payload = error.code, {
+                'success': False,
+                'error': error.code,
+                'message': error.message
+                }
+        except Exception as error:
+            status, payload = 500, {
+                'success': False,
+                'error': 500,
+                'message': f'Internal Server error: {error}'
+                }
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'access-control-allow-origin', b'*'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': json.dumps(payload, sort_keys=True).encode(),
+        })
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.pool = await asyncpg.create_pool(
+                    self.dsn, min_size=1, max_size=self.pool_size
+                    )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, request):
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if match:
+                if request.method != method:
+                    raise HTTPError(405, 'Method Not Allowed')
+                return await handler(request, *map(int, match.groups()))
+        raise HTTPError(404, 'Not Found')
+
+    # Queries
+    # ------------------------------------------------------------------------#
+    async def count(self, connection, name, where='', *args):
+        value = await connection.fetchval(
+            'SELECT value FROM counters WHERE name = $1', name
+            )
+        if value is None:
+            value = await connection.fetchval(
+                f'SELECT count(*) FROM questions {where}', *args
+                )
+        return value
+
+    async def categories(self, connection):
+        rows = await connection.fetch(
+            'SELECT id, type FROM categories ORDER BY id'
+            )
+        return {row['id']: row['type'] for row in rows}
+
+    async def page(self, connection, request, where='', *args):
+        after, offset = request.page_window()
+        conditions = [where] if where else []
+        if after is not None:
+            args += (after,)
+            conditions.append(f'id > ${len(args)}')
+        sql = f'SELECT {QUESTION_COLUMNS} FROM questions'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f' ORDER BY id LIMIT {QUESTIONS_PER_PAGE} OFFSET {offset}'
+        return [dict(row) for row in await connection.fetch(sql, *args)]
+
+    # Routes
+    # ------------------------------------------------------------------------#
+    async def get_categories(self, request):
+        async with self.pool.acquire() as connection:
+            categories = await self.categories(connection)
+        if not categories:
+            raise HTTPError(404, 'Categories not found')
+        return {'success': True, 'categories': categories}
+
+    async def get_questions(self, request):
+        request.reject_unsupported()
+        async with self.pool.acquire() as connection:
+            try:
+                current_questions = await self.page(connection, request)
+            except ValueError:
+                current_questions = []
+            if not current_questions:
+                raise HTTPError(404, 'Questions not found')
+            categories = await self.categories(connection)
+            total = await self.count(connection, 'questions')
+        return {
+            'success': True,
+            'questions': current_questions,
+            'total_questions': total,
+            'current_category': None,
+            'categories': categories,
+            'next_cursor': next_cursor(
+                [question['id'] for question in current_questions]
+                )
+            }
+
+    async def get_questions_by_category(self, request, category_id):
+        request.reject_unsupported()
+        async with self.pool.acquire() as connection:
+            try:
+                current_questions = await self.page(
+                    connection, request, 'category = $1', category_id
+                    )
+            except ValueError:
+                current_questions = []
+            if not current_questions:
+                raise HTTPError(422, 'unprocessable')
+            total = await self.count(
+                connection, f'questions:category:{category_id}',
+                'WHERE category = $1', category_id
+                )
+        return {
+            'success': True,
+            'questions': current_questions,
+            'total_questions': total,
+            'current_category': category_id,
+            'next_cursor': next_cursor(
+                [question['id'] for question in current_questions]
+                )
+            }
+
+    async def search_questions(self, request):
+        body = request.get_json()
+        tokens = tokenize(body.get('searchTerm', None))
+        try:
+            # search cursors hold the (rank, id) of the last result
+            after, offset = request.page_window(
+                lambda cursor: decode_sort_cursor(cursor, float)
+                )
+        except ValueError:
+            raise HTTPError(422, 'unprocessable')
+
+        where, rank, args = '', '0', []
+        if tokens:
+            args.append(' & '.join(f'{token}:*' for token in tokens))
+            where = f"WHERE {SEARCH_DOCUMENT} @@ to_tsquery('simple', $1)"
+            rank = f"ts_rank({SEARCH_DOCUMENT}, to_tsquery('simple', $1))"
+
+        async with self.pool.acquire() as connection:
+            total = await connection.fetchval(
+                f'SELECT count(*) FROM questions {where}', *args
+                )
+            if total == 0:
+                raise HTTPError(404, 'Question not found')
+
+            sql = (f'SELECT {QUESTION_COLUMNS}, {rank} AS rank '
+                   f'FROM questions {where}')
+            if after is not None:
+                args += after
+                sql += ((' AND ' if where else ' WHERE ')
+                        + f'(-{rank}, id) > (-${len(args) - 1}::real, '
+                        f'${len(args)})')
+            sql += (f' ORDER BY rank DESC, id '
+                    f'LIMIT {QUESTIONS_PER_PAGE} OFFSET {offset}')
+            rows = await connection.fetch(sql, *args)
+
+        if not rows:
+            raise HTTPError(422, 'unprocessable')
+        cursor = None
+        if len(rows) == QUESTIONS_PER_PAGE:
+            cursor = encode_sort_cursor(rows[-1]['rank'], rows[-1]['id'])
+        return {
+            'success': True,
+            'questions': [
+                {key: row[key] for key in QUESTION_COLUMNS.split(', ')}
+                for row in rows
+                ],
+            'total_questions': total,
+            'next_cursor': cursor
+            }
+
+    async def play_quiz(self, request):
+        try:
+            body = request.get_json()
+            category_id = int(body['quiz_category']['id'])
+            previous_questions = [
+                int(i) for i in body.get('previous_questions', None) or []
+                ]
+            count = int(body.get('count', 1))
+        except (HTTPError, ValueError, TypeError, KeyError):
+            raise HTTPError(422, 'unprocessable')
+        if not 1 <= count <= MAX_QUIZ_QUESTIONS:
+            raise HTTPError(422, 'unprocessable')
+        if count > 1:
+            return await self.play_quiz_batch(
+                category_id, previous_questions, count
+                )
+
+        conditions, args = [], []
+        if category_id != 0:
+            args.append(category_id)
+            conditions.append('category = $1')
+        name = (f'questions:category:{category_id}' if category_id
+                else 'questions')
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        async with self.pool.acquire() as connection:
+            total = await self.count(connection, name, where, *args)
+            if previous_questions:
+                args.append(previous_questions)
+                conditions.append(f'id = ANY(${len(args)}::int[])')
+                total -= await connection.fetchval(
+                    'SELECT count(*) FROM questions WHERE '
+                    + ' AND '.join(conditions), *args
+                    )
+                conditions[-1] = f'NOT (id = ANY(${len(args)}::int[]))'
+            if total <= 0:
+                return {'success': True, 'question': None}
+
+            where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+            sql = (f'SELECT {QUESTION_COLUMNS} FROM questions {where} '
+                   f'ORDER BY id LIMIT 1 OFFSET $' + str(len(args) + 1))
+            row = (await connection.fetchrow(
+                sql, *args, random.randrange(total)
+                ) or await connection.fetchrow(sql, *args, 0))
+
+        response = {'success': True, 'question': dict(row) if row else None}
+        if 'count' in body:
+            response['questions'] = [response['question']] if row else []
+        return response
+
+    async def play_quiz_batch(self, category_id, previous_questions, count):
+        conditions, args = [], []
+        if category_id != 0:
+            args.append(category_id)
+            conditions.append(f'category = ${len(args)}')
+        if previous_questions:
+            args.append(previous_questions)
+            conditions.append(f'NOT (id = ANY(${len(args)}::int[]))')
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(
+                f'SELECT {QUESTION_COLUMNS} FROM questions {where} '
+                f'ORDER BY random() LIMIT {count}', *args
+                )
+        questions = [dict(row) for row in rows]
+        return {
+            'success': True,
+            'question': questions[0] if questions else None,
+            'questions': questions
+            }
+
+
+app = TriviaApp(database_path, int(os.environ.get('DB_POOL_SIZE', 20)))
@@ -0,0 +1,126 @@
+import logging
+import time
+
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+# ----------------------------------------------------------------------------#
+# QUERY BUDGET
+# ----------------------------------------------------------------------------#
+'''
+Counts the statements each request issues and the rows its SELECTs return,
+and logs the plan of any statement slower than SLOW_QUERY_MS. With
+ENFORCE_QUERY_BUDGET (tests, benchmarks) a request that goes over
+QUERY_BUDGET statements or ROW_BUDGET rows fails with a 500 naming the
+budget, so an accidental extra scan breaks the build instead of only
+showing up in the metrics.
+'''
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+class QueryBudget:
+
+    def __init__(self, app, engines, max_queries=None, max_rows=None,
+                 slow_query_ms=None, enforce=False):
+        self.max_queries = max_queries
+        self.max_rows = max_rows
+        self.slow_query = (slow_query_ms / 1000
+                           if slow_query_ms is not None else None)
+        self.enforce = enforce
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute',
+                         self.start_statement)
+            event.listen(engine, 'after_cursor_execute',
+                         self.finish_statement)
+
+    def start_request(self):
+        g.budget_queries = 0
+        g.budget_rows = 0
+
+    def overrun(self):
+        if (self.max_queries is not None
+                and g.budget_queries > self.max_queries):
+            return (f'{g.budget_queries} statements '
+                    f'(budget {self.max_queries})')
+        if self.max_rows is not None and g.budget_rows > self.max_rows:
+            return f'{g.budget_rows} rows fetched (budget {self.max_rows})'
+        return None
+
+    def finish_request(self, response):
+        if 'budget_queries' not in g:
+            return response
+        overrun = self.overrun()
+        if overrun is None:
+            return response
+
+        logger.warning('%s %s exceeded its query budget: %s',
+                       request.method, request.path, overrun)
+        if not self.enforce:
+            return response
+        # rewritten in place to keep the headers other hooks already set
+        error = jsonify({
+            'success': False,
+            'error': 500,
+            'message': f'Query budget exceeded: {overrun}'
+            })
+        response.set_data(error.get_data())
+        response.mimetype = error.mimetype
+        response.status_code = 500
+        return response
+
+    def start_statement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('budget_start', []).append(time.perf_counter())
+
+    def finish_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        elapsed = time.perf_counter() - conn.info['budget_start'].pop()
+        if has_request_context() and 'budget_queries' in g:
+            g.budget_queries += 1
+            # drivers report the size of a buffered SELECT result in
+            # rowcount, others (sqlite3) leave it at -1
+            if cursor.description is not None and cursor.rowcount > 0:
+                g.budget_rows += cursor.rowcount
+
+        if (self.slow_query is not None and elapsed > self.slow_query
+                and not executemany):
+            logger.warning('Slow statement (%.1f ms): %s\n%s',
+                           elapsed * 1000, statement,
+                           self.explain(conn, statement, parameters))
+
+    def explain(self, conn, statement, parameters):
+        '''
+        Plans the statement on the raw DBAPI connection, which bypasses the
+        engine events so the EXPLAIN is neither counted nor timed itself.
+        '''
+        explain_prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if (explain_prefix is None
+                or not statement.lstrip().upper().startswith('SELECT')):
+            return '(no plan)'
+        # a failed statement would abort the request's Postgres transaction
+        savepoint = conn.dialect.name == 'postgresql'
+        cursor = conn.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT query_budget_explain')
+            cursor.execute(explain_prefix + statement, parameters)
+            return '\n'.join(
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+                )
+        except Exception as error:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT query_budget_explain')
+            return f'(plan unavailable: {error})'
+        finally:
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT query_budget_explain')
+            cursor.close()
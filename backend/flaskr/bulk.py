@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+from collections import Counter as Tally
+
+from sqlalchemy import text
+
+from models import db, Question, Category, Counter
+
+# ----------------------------------------------------------------------------#
+# BULK IMPORT / EXPORT
+# ----------------------------------------------------------------------------#
+'''
+Streaming bulk loading and backup of questions and categories. Uploads are
+read line by line from the request stream and inserted with executemany in
+chunked transactions; exports walk the table in keyset batches so neither
+direction holds the whole table in memory.
+'''
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty',
+                   'rating')
+NULLABLE_QUESTION_FIELDS = ('category', 'difficulty', 'rating')
+CATEGORY_FIELDS = ('id', 'type')
+EXPORT_BATCH_SIZE = 1000
+
+
+class BulkImportError(ValueError):
+    '''
+    Raised for a row that cannot be imported; `imported` rows before it have
+    already been committed.
+    '''
+
+    def __init__(self, line, message, imported):
+        super().__init__(
+            f'Line {line}: {message} ({imported} rows imported)'
+            )
+        self.imported = imported
+
+
+def read_rows(stream, content_type):
+    '''
+    Yields (line number, dict) from an NDJSON or CSV (with header) upload.
+    '''
+    lines = (line.decode('utf-8') for line in stream)
+    if content_type == 'text/csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {
+                key: value for key, value in row.items() if value != ''
+                }
+    else:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as error:
+                    yield number, error
+
+
+def question_row(row):
+    if isinstance(row, Exception):
+        raise row
+    if not (row.get('question') and row.get('answer')):
+        raise ValueError('Required object keys missing from row')
+    values = {'question': str(row['question']), 'answer': str(row['answer'])}
+    # exports write NULL columns as null (NDJSON) or an empty field (CSV)
+    for key in NULLABLE_QUESTION_FIELDS:
+        value = row.get(key)
+        values[key] = None if value is None else int(value)
+    if row.get('id') is not None:
+        values['id'] = int(row['id'])
+    return values
+
+
+def category_row(row):
+    if isinstance(row, Exception):
+        raise row
+    if not row.get('type'):
+        raise ValueError('Required object keys missing from row')
+    values = {'type': str(row['type'])}
+    if row.get('id') is not None:
+        values['id'] = int(row['id'])
+    return values
+
+
+def insert_chunk(table, chunk):
+    # executemany needs the same keys on every row
+    with_ids = [values for values in chunk if 'id' in values]
+    without_ids = [values for values in chunk if 'id' not in values]
+    for rows in (with_ids, without_ids):
+        if rows:
+            db.session.execute(table.insert(), rows)
+
+
+def sync_sequence(table):
+    '''
+    Moves the id sequence past imported explicit ids so later inserts do not
+    collide with them.
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "coalesce(max(id), 1)) FROM {0}".format(table.name)
+            ))
+
+
+def import_rows(rows, chunk_size, table, convert, on_chunk):
+    imported = 0
+    chunk = []
+    line = 0
+
+    def flush():
+        insert_chunk(table, chunk)
+        on_chunk(chunk)
+        db.session.commit()
+
+    try:
+        for line, row in rows:
+            chunk.append(convert(row))
+            if len(chunk) == chunk_size:
+                flush()
+                imported += len(chunk)
+                chunk = []
+        if chunk:
+            flush()
+            imported += len(chunk)
+    except Exception as error:
+        db.session.rollback()
+        raise BulkImportError(line, error, imported)
+
+    sync_sequence(table)
+    db.session.commit()
+    return imported
+
+
+def count_questions(chunk):
+    for category, delta in Tally(v['category'] for v in chunk).items():
+        Counter.incr_questions(category, delta)
+    Counter.bump('questions')
+
+
+def count_categories(chunk):
+    Counter.seed_categories(db.session)
+    Counter.incr('categories', len(chunk))
+    Counter.bump('categories')
+
+
+def import_questions(rows, chunk_size):
+    return import_rows(rows, chunk_size, Question.__table__, question_row,
+                       count_questions)
+
+
+def import_categories(rows, chunk_size):
+    return import_rows(rows, chunk_size, Category.__table__, category_row,
+                       count_categories)
+
+
+def export_rows(model, fields, output_format):
+    '''
+    Generator of NDJSON lines or CSV rows (header first), read in keyset
+    batches of EXPORT_BATCH_SIZE ordered on id.
+    '''
+    columns = [getattr(model, field) for field in fields]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if output_format == 'csv':
+        writer.writerow(fields)
+        yield buffer.getvalue()
+
+    last_id = 0
+    while True:
+        batch = db.session.query(*columns).filter(
+            model.id > last_id
+            ).order_by(model.id).limit(EXPORT_BATCH_SIZE).all()
+        if not batch:
+            return
+        for row in batch:
+            if output_format == 'csv':
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerow(row)
+                yield buffer.getvalue()
+            else:
+                yield json.dumps(dict(zip(fields, row))) + '\n'
+        last_id = batch[-1][0]
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+
+from models import Category
+from .conditional import resource_version
+
+# ----------------------------------------------------------------------------#
+# STORES
+# ----------------------------------------------------------------------------#
+'''
+A store is anything with get(key), set(key, value, ttl) and delete(key).
+LocalStore keeps entries in this process; a shared store (memcached, redis)
+can be passed as `CACHE_STORE` in the app config, in which case values must
+be bytes or strings.
+'''
+
+
+class LocalStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+# ----------------------------------------------------------------------------#
+# CATEGORIES
+# ----------------------------------------------------------------------------#
+class CategoryCache:
+    '''
+    Read-through cache of the {id: type} category map, held as the JSON bytes
+    that responses embed. Entries are keyed by the categories version, which
+    every category write bumps, so no process serves a map older than the
+    ETag it is sent with; the TTL only reclaims entries of old versions.
+    '''
+    key = 'categories'
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.current = None
+
+    def serialized(self):
+        key = '{}:{}'.format(self.key, resource_version('categories'))
+        value = self.store.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        categories = Category.query.order_by(Category.id).all()
+        value = json.dumps(
+            {category.id: category.type for category in categories},
+            separators=(',', ':')
+            ).encode()
+        self.store.set(key, value, self.ttl)
+        previous, self.current = self.current, key
+        if previous is not None and previous != key:
+            self.store.delete(previous)
+        return value
+
+    def categories(self):
+        return json.loads(self.serialized())
@@ -0,0 +1,106 @@
+import json
+import threading
+from collections import Counter as Tally
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+
+from models import db
+
+# ----------------------------------------------------------------------------#
+# REQUEST COALESCING
+# ----------------------------------------------------------------------------#
+'''
+Single-flight for read endpoints: while a request is being answered, other
+requests for the same route and normalized arguments wait for it and get a
+copy of its response instead of running the same queries again. Only
+requests that arrive while the first one is in flight share its result, so
+nothing is served after it completes. Views must return buffered (not
+streamed) responses.
+'''
+
+
+class Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.coalesced = Tally()
+
+    def do(self, key, fn):
+        '''
+        Returns fn(), or the result of the call already running for `key`.
+        A caller that waited longer than `timeout` runs fn() itself.
+        '''
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                return fn()
+            with self.lock:
+                self.coalesced[key[0]] += 1
+            return flight.result()
+
+        try:
+            flight.value = fn()
+            return flight.value
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+
+def request_key():
+    '''
+    Requests that read through different versions (the ETag computed by
+    `conditional`) or from a different database (a client pinned to the
+    primary after a write) never share a result.
+    '''
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    return (
+        request.endpoint,
+        tuple(sorted((request.view_args or {}).items())),
+        tuple(sorted(request.args.items(multi=True))),
+        json.dumps(body, sort_keys=True),
+        g.get('resource_etag'),
+        bool(db.session.info.get('read_replica'))
+        )
+
+
+def coalesce(single_flight):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if single_flight is None:
+                return f(*args, **kwargs)
+
+            def respond():
+                response = make_response(f(*args, **kwargs))
+                return (response.get_data(), response.status_code,
+                        list(response.headers))
+
+            data, status, headers = single_flight.do(request_key(), respond)
+            return current_app.response_class(data, status, headers)
+        return wrapper
+    return decorator
@@ -0,0 +1,81 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# ----------------------------------------------------------------------------#
+# RESPONSE COMPRESSION
+# ----------------------------------------------------------------------------#
+'''
+Compresses JSON, NDJSON, CSV and metrics bodies of at least `min_size`
+bytes with the best encoding the client accepts: brotli when the package is
+installed, otherwise gzip. Streamed responses are gzipped chunk by chunk as
+they are produced. Compressed responses get a weak ETag, since the bytes
+differ from the identity representation while the content is the same.
+'''
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'text/csv', 'text/plain'
+}
+BROTLI_QUALITY = 4
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class Compressor:
+
+    def __init__(self, app, min_size, level):
+        self.min_size = min_size
+        self.level = level
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        app.after_request(self.compress)
+
+    def compressible(self, response):
+        return (response.status_code == 200
+                and response.mimetype in COMPRESSIBLE_MIMETYPES
+                and 'Content-Encoding' not in response.headers
+                and not response.direct_passthrough)
+
+    def compress(self, response):
+        if not self.compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if response.is_streamed:
+            if not request.accept_encodings['gzip']:
+                return response
+            encoding = 'gzip'
+            response.response = gzip_stream(response.response, self.level)
+        else:
+            encoding = request.accept_encodings.best_match(self.encodings)
+            if (encoding is None
+                    or (response.content_length or 0) < self.min_size):
+                return response
+            data = response.get_data()
+            if encoding == 'br':
+                data = brotli.compress(data, quality=BROTLI_QUALITY)
+            else:
+                compressor = zlib.compressobj(
+                    self.level, zlib.DEFLATED, GZIP_WBITS
+                    )
+                data = compressor.compress(data) + compressor.flush()
+            response.set_data(data)
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
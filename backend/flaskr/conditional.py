@@ -0,0 +1,62 @@
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+
+from models import Counter
+
+# ----------------------------------------------------------------------------#
+# CONDITIONAL REQUESTS
+# ----------------------------------------------------------------------------#
+'''
+Read endpoints are tagged with an ETag built from the version counters of
+the resources they render. A matching If-None-Match is answered with
+304 Not Modified before the handler runs, so an unchanged page costs one
+primary key lookup per resource instead of the listing queries.
+'''
+
+
+def resource_version(resource):
+    '''
+    The version of `resource` read once per request, so a body cached per
+    version is always the one the request's ETag was built from.
+    '''
+    versions = g.setdefault('resource_versions', {})
+    if resource not in versions:
+        versions[resource] = Counter.version(resource)
+    return versions[resource]
+
+
+def resource_etag(resources):
+    return '-'.join(
+        '{}{}'.format(resource[0], resource_version(resource))
+        for resource in resources
+        )
+
+
+def cache_control(response):
+    max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def conditional(*resources):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = g.resource_etag = resource_etag(resources)
+            # weak comparison, compressed responses carry W/ tags
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return cache_control(response)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                cache_control(response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+import weakref
+from array import array
+
+from sqlalchemy import event
+
+from models import db, Question
+
+# ----------------------------------------------------------------------------#
+# QUIZ DECKS
+# ----------------------------------------------------------------------------#
+'''
+Precomputed shuffled decks of question ids per category (0 for all
+categories), packed as unsigned int arrays. play_quiz draws a random slot
+of the deck instead of querying the candidate set. Decks follow ORM inserts
+and deletes in this process and are rebuilt after `refresh` seconds to pick
+up writes made by other workers.
+'''
+MAX_DRAW_ATTEMPTS = 16
+
+
+class QuizDecks:
+
+    def __init__(self, engine, refresh):
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.decks = {}
+        _quiz_decks[engine] = self
+
+    def build(self, category):
+        selection = db.session.query(Question.id)
+        if category != 0:
+            selection = selection.filter(Question.category == category)
+        deck = array('I', (question_id for question_id, in selection))
+        random.shuffle(deck)
+        return deck
+
+    def deck(self, category):
+        with self.lock:
+            entry = self.decks.get(category)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+
+        deck = self.build(category)
+        with self.lock:
+            self.decks[category] = (deck, time.monotonic() + self.refresh)
+        return deck
+
+    def draw(self, category, previous_questions):
+        '''
+        Returns a random question id of the category that is not in
+        `previous_questions`, or None once the category is exhausted.
+        '''
+        drawn = self.draw_many(category, previous_questions, 1)
+        return drawn[0] if drawn else None
+
+    def draw_many(self, category, previous_questions, count):
+        '''
+        Returns up to `count` distinct random question ids of the category
+        that are not in `previous_questions`, fewer once it runs out.
+        '''
+        deck = self.deck(category)
+        excluded = set(previous_questions)
+        drawn = []
+        # add and remove resize the deck in place
+        with self.lock:
+            if not deck:
+                return drawn
+
+            for _ in range(MAX_DRAW_ATTEMPTS * count):
+                question_id = deck[random.randrange(len(deck))]
+                if question_id not in excluded:
+                    excluded.add(question_id)
+                    drawn.append(question_id)
+                    if len(drawn) == count:
+                        return drawn
+
+            # mostly exhausted deck, walk it from a random slot instead
+            start = random.randrange(len(deck))
+            for position in range(len(deck)):
+                question_id = deck[(start + position) % len(deck)]
+                if question_id not in excluded:
+                    excluded.add(question_id)
+                    drawn.append(question_id)
+                    if len(drawn) == count:
+                        break
+            return drawn
+
+    def add(self, question_id, category):
+        with self.lock:
+            for key in {0, category}:
+                entry = self.decks.get(key)
+                if entry is not None:
+                    deck = entry[0]
+                    # append, then swap into a random slot to stay shuffled
+                    deck.append(question_id)
+                    slot = random.randrange(len(deck))
+                    deck[slot], deck[-1] = deck[-1], deck[slot]
+
+    def remove(self, question_id, category=None):
+        with self.lock:
+            keys = [0, category] if category is not None else list(self.decks)
+            for key in keys:
+                entry = self.decks.get(key)
+                if entry is not None and question_id in entry[0]:
+                    entry[0].remove(question_id)
+
+    def invalidate(self, category=None):
+        with self.lock:
+            if category is None:
+                self.decks.clear()
+            else:
+                self.decks.pop(category, None)
+
+
+_quiz_decks = weakref.WeakKeyDictionary()
+
+
+@event.listens_for(Question, 'after_insert')
+def deal_question(mapper, connection, target):
+    decks = _quiz_decks.get(connection.engine)
+    if decks is not None:
+        decks.add(target.id, target.category)
+
+
+@event.listens_for(Question, 'after_delete')
+def discard_question(mapper, connection, target):
+    decks = _quiz_decks.get(connection.engine)
+    if decks is not None:
+        decks.remove(target.id, target.category)
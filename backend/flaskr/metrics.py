@@ -0,0 +1,188 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# ----------------------------------------------------------------------------#
+# INSTRUMENTATION
+# ----------------------------------------------------------------------------#
+'''
+Per-route latency, SQL statement count and time per request (from engine
+events), serialization time and cache hit rates. Each response carries a
+Server-Timing header and the totals are exposed at /metrics in the
+Prometheus text format.
+'''
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+class Histogram:
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, route, value):
+        '''
+        Bucket counts are cumulative, as the exposition format expects.
+        '''
+        with self.lock:
+            counts, total, count = self.series.get(
+                route, ([0] * len(self.buckets), 0, 0)
+                )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.series[route] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self.lock:
+            series = sorted(
+                (route, list(counts), total, count)
+                for route, (counts, total, count) in self.series.items()
+                )
+        for route, counts, total, count in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f'{self.name}_bucket{{route="{route}",le="{bound}"}} '
+                    f'{bucket_count}'
+                    )
+            lines.append(
+                f'{self.name}_bucket{{route="{route}",le="+Inf"}} {count}'
+                )
+            lines.append(f'{self.name}_sum{{route="{route}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{route="{route}"}} {count}')
+        return lines
+
+
+class Metrics:
+
+    def __init__(self, app, engines):
+        self.request_duration = Histogram(
+            'trivia_request_duration_seconds',
+            'Request latency by route', LATENCY_BUCKETS
+            )
+        self.sql_duration = Histogram(
+            'trivia_sql_duration_seconds',
+            'Time spent in SQL statements per request', LATENCY_BUCKETS
+            )
+        self.sql_queries = Histogram(
+            'trivia_sql_queries_per_request',
+            'SQL statements issued per request', QUERY_COUNT_BUCKETS
+            )
+        self.serialize_duration = Histogram(
+            'trivia_serialize_duration_seconds',
+            'Time spent building JSON bodies per request', LATENCY_BUCKETS
+            )
+        self.caches = {}
+        self.counters = {}
+        self.gauges = {}
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute',
+                         self.start_statement)
+            event.listen(engine, 'after_cursor_execute',
+                         self.finish_statement)
+
+    def register_cache(self, name, cache):
+        '''
+        `cache` exposes `hits` and `misses` counters.
+        '''
+        self.caches[name] = cache
+
+    def register_counter(self, name, description, label, read):
+        '''
+        `read` returns a mapping of `label` values to counts.
+        '''
+        self.counters[name] = (description, label, read)
+
+    def register_gauge(self, name, description, read):
+        self.gauges[name] = (description, read)
+
+    # Hooks
+    # ------------------------------------------------------------------------#
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_time = 0.0
+        g.serialize_time = 0.0
+
+    def finish_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        route = request.endpoint or 'unmatched'
+
+        self.request_duration.observe(route, elapsed)
+        self.sql_duration.observe(route, g.sql_time)
+        self.sql_queries.observe(route, g.sql_queries)
+        self.serialize_duration.observe(route, g.serialize_time)
+
+        response.headers['Server-Timing'] = (
+            f'db;dur={g.sql_time * 1000:.2f};desc="{g.sql_queries} queries", '
+            f'serialize;dur={g.serialize_time * 1000:.2f}, '
+            f'total;dur={elapsed * 1000:.2f}'
+            )
+        response.headers['Timing-Allow-Origin'] = '*'
+        return response
+
+    def start_statement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('statement_start', []).append(
+            time.perf_counter()
+            )
+
+    def finish_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        elapsed = time.perf_counter() - conn.info['statement_start'].pop()
+        if has_request_context() and 'sql_queries' in g:
+            g.sql_queries += 1
+            g.sql_time += elapsed
+
+    # Exposition
+    # ------------------------------------------------------------------------#
+    def render(self):
+        lines = []
+        for histogram in (self.request_duration, self.sql_duration,
+                          self.sql_queries, self.serialize_duration):
+            lines += histogram.render()
+
+        for kind in ('hits', 'misses'):
+            lines.append(f'# TYPE trivia_cache_{kind}_total counter')
+            for name, cache in sorted(self.caches.items()):
+                lines.append(
+                    f'trivia_cache_{kind}_total{{cache="{name}"}} '
+                    f'{getattr(cache, kind)}'
+                    )
+
+        for name, (description, label, read) in sorted(self.counters.items()):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            for value, count in sorted(read().items()):
+                lines.append(f'{name}{{{label}="{value}"}} {count}')
+
+        for name, (description, read) in sorted(self.gauges.items()):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {read()}')
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def timed_serialization():
+    start = time.perf_counter()
+    yield
+    if has_request_context() and 'serialize_time' in g:
+        g.serialize_time += time.perf_counter() - start
@@ -0,0 +1,150 @@
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+from flask import Response, stream_with_context
+from sqlalchemy import event
+
+from models import Question, QuestionRow
+from .conditional import resource_version
+from .metrics import timed_serialization
+
+try:
+    import orjson
+except ImportError:  # optional faster encoder
+    orjson = None
+
+# ----------------------------------------------------------------------------#
+# SERIALIZED PAYLOADS
+# ----------------------------------------------------------------------------#
+'''
+List endpoints read the ids of a page and stitch cached JSON fragments of
+each question into the response body, so hot questions skip both loading
+and Question.format() + jsonify; misses are read as QuestionRow tuples.
+Fragments are evicted least recently used first. They belong to the
+questions version the request's ETag was built from: the first request that
+sees a newer version (after a write in any process) drops them all, and
+requests still on an older version bypass the cache.
+'''
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(
+            value, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            )
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+
+
+class RawJSON(bytes):
+    '''
+    Already serialized JSON that json_response embeds verbatim.
+    '''
+
+
+def json_members(payload):
+    return b','.join(
+        dumps(key) + b':' + (value if isinstance(value, RawJSON)
+                             else dumps(value))
+        for key, value in sorted(payload.items())
+        )
+
+
+def json_response(payload, status=200):
+    with timed_serialization():
+        body = b'{' + json_members(payload) + b'}\n'
+    return Response(body, status=status, mimetype='application/json')
+
+
+def json_stream(payload, key, rows, batch_size):
+    '''
+    Streams `payload` followed by `key` bound to a JSON array of the
+    formatted `rows`, encoding and sending `batch_size` rows per chunk so
+    the whole list is never held in memory.
+    '''
+    def generate():
+        yield b'{' + json_members(payload) + b',' + dumps(key) + b':['
+        batch = []
+        separator = b''
+        for row in rows:
+            batch.append(dumps(row.format()))
+            if len(batch) == batch_size:
+                yield separator + b','.join(batch)
+                batch, separator = [], b','
+        if batch:
+            yield separator + b','.join(batch)
+        yield b']}\n'
+
+    return Response(
+        stream_with_context(generate()), mimetype='application/json'
+        )
+
+
+class QuestionPayloads:
+
+    def __init__(self, engine, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.fragments = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        _question_payloads[engine] = self
+
+    def array(self, question_ids):
+        '''
+        Returns the JSON array of the questions in `question_ids` order,
+        loading only the ones that are not cached. Ids that no longer exist
+        are left out.
+        '''
+        version = resource_version('questions')
+        found = {}
+        with self.lock:
+            if self.version is None or version > self.version:
+                self.fragments.clear()
+                self.version = version
+            current = version == self.version
+            for question_id in question_ids if current else ():
+                fragment = self.fragments.get(question_id)
+                if fragment is not None:
+                    self.fragments.move_to_end(question_id)
+                    found[question_id] = fragment
+        missing = [i for i in question_ids if i not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            questions = QuestionRow.all(
+                QuestionRow.query().filter(Question.id.in_(missing))
+                )
+            with timed_serialization():
+                loaded = {
+                    question.id: dumps(question.format())
+                    for question in questions
+                    }
+            found.update(loaded)
+            with self.lock:
+                if version == self.version:
+                    self.fragments.update(loaded)
+                while len(self.fragments) > self.capacity:
+                    self.fragments.popitem(last=False)
+
+        return RawJSON(b'[' + b','.join(
+            found[i] for i in question_ids if i in found
+            ) + b']')
+
+    def discard(self, question_id):
+        with self.lock:
+            self.fragments.pop(question_id, None)
+
+
+_question_payloads = weakref.WeakKeyDictionary()
+
+
+@event.listens_for(Question, 'after_update')
+@event.listens_for(Question, 'after_delete')
+def discard_payload(mapper, connection, target):
+    payloads = _question_payloads.get(connection.engine)
+    if payloads is not None:
+        payloads.discard(target.id)
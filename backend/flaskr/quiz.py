@@ -0,0 +1,78 @@
+import random
+import secrets
+from array import array
+
+# ----------------------------------------------------------------------------#
+# QUIZ SESSIONS
+# ----------------------------------------------------------------------------#
+'''
+Server-side quiz state. Starting a session draws at most `max_size` of the
+eligible question ids in random order and keeps them in the store as a
+packed array of unsigned ints next to a position counter, so each `next`
+reads one slot of the deck instead of the client resending every previous
+question.
+'''
+ID_SIZE = array('I').itemsize
+
+
+class QuizSessions:
+
+    def __init__(self, store, ttl, max_size):
+        self.store = store
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def keys(self, token):
+        return f'quiz:{token}:deck', f'quiz:{token}:position'
+
+    def start(self, question_ids, size=None):
+        '''
+        Returns (token, number of questions in the session), at most `size`,
+        or `max_size` when it is omitted. Raises ValueError unless `size` is
+        an int from 1 to `max_size`.
+        '''
+        if size is None:
+            size = self.max_size
+        elif type(size) is not int or not 1 <= size <= self.max_size:
+            raise ValueError(f'Invalid session size: {size!r}')
+        # samples positions so only the drawn ids are copied, not the deck
+        positions = random.sample(
+            range(len(question_ids)), min(size, len(question_ids))
+            )
+        deck = array('I', (question_ids[i] for i in positions))
+
+        token = secrets.token_urlsafe(16)
+        deck_key, position_key = self.keys(token)
+        self.store.set(deck_key, deck.tobytes(), self.ttl)
+        self.store.set(position_key, b'0', self.ttl)
+        return token, len(deck)
+
+    def next(self, token):
+        '''
+        Returns (question id or None when the deck is used up, remaining
+        questions). Raises KeyError for unknown or expired sessions.
+        '''
+        deck_key, position_key = self.keys(token)
+        deck = self.store.get(deck_key)
+        position = self.store.get(position_key)
+        if deck is None or position is None:
+            raise KeyError(token)
+
+        position = int(position)
+        total = len(deck) // ID_SIZE
+        if position >= total:
+            return None, 0
+
+        self.store.set(position_key, str(position + 1).encode(), self.ttl)
+        start = position * ID_SIZE
+        question_id = array('I', deck[start:start + ID_SIZE])[0]
+        return question_id, total - position - 1
+
+    def finish(self, token):
+        deck_key, position_key = self.keys(token)
+        position = self.store.get(position_key)
+        if position is None:
+            raise KeyError(token)
+        self.store.delete(deck_key)
+        self.store.delete(position_key)
+        return int(position)
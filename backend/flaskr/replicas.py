@@ -0,0 +1,53 @@
+import random
+import time
+
+from flask import request
+
+from models import db
+
+# ----------------------------------------------------------------------------#
+# READ REPLICA ROUTING
+# ----------------------------------------------------------------------------#
+'''
+Picks one replica for each read request (GET, plus the POST routes in
+`read_endpoints` that only query) and stores it on the session, so
+models.RoutingSession sends all of the request's statements there: the
+version behind an ETag and the rows of the body come from the same
+snapshot lag. A successful write sets a cookie that keeps the
+client's reads on the primary for `sticky` seconds, long enough for the
+replicas to catch up, so a client always reads its own writes.
+'''
+PRIMARY_COOKIE = 'read_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReadRouting:
+
+    def __init__(self, app, replicas, sticky, read_endpoints):
+        self.replicas = replicas
+        self.sticky = sticky
+        self.read_endpoints = set(read_endpoints)
+        app.before_request(self.route_request)
+        app.after_request(self.stick_to_primary)
+        app.teardown_request(self.reset)
+
+    def is_read(self):
+        return (request.method in READ_METHODS
+                or request.endpoint in self.read_endpoints)
+
+    def route_request(self):
+        primary_until = request.cookies.get(PRIMARY_COOKIE, 0, type=float)
+        if self.is_read() and time.time() >= primary_until:
+            db.session.info['read_replica'] = random.choice(self.replicas)
+
+    def stick_to_primary(self, response):
+        if (not self.is_read() and request.method != 'OPTIONS'
+                and response.status_code < 400 and self.sticky):
+            response.set_cookie(
+                PRIMARY_COOKIE, str(time.time() + self.sticky),
+                max_age=self.sticky, httponly=True
+                )
+        return response
+
+    def reset(self, error=None):
+        db.session.info.pop('read_replica', None)
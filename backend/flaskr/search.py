@@ -0,0 +1,249 @@
+import re
+import threading
+import weakref
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from sqlalchemy import REAL, cast, event, func, literal_column, text, tuple_
+
+from models import db, Question, QuestionRow
+
+# ----------------------------------------------------------------------------#
+# FULL-TEXT SEARCH
+# ----------------------------------------------------------------------------#
+'''
+Search over question and answer text. Postgres matches against an expression
+GIN index on the tsvector below; other databases (SQLite in tests) fall back
+to an in-process inverted index kept in step with ORM inserts and deletes.
+Both rank the matches and return the ids and ranks of the requested page,
+or stream every match in rank order. Pages continue after a (rank, id)
+position, the ranks of terms without tokens are 0.
+'''
+SEARCH_CONFIG = 'simple'
+SEARCH_DOCUMENT = (
+    "to_tsvector('simple', coalesce(questions.question, '') || ' ' || "
+    "coalesce(questions.answer, ''))"
+)
+SEARCH_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_questions_search ON questions "
+    "USING gin ({})".format(SEARCH_DOCUMENT.replace('questions.', ''))
+)
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall((value or '').lower())
+
+
+class FullTextSearch:
+    '''
+    Postgres backend: `term` is split into prefix lexemes (`what:* & is:*`)
+    so partially typed words from the search box still match.
+    '''
+
+    def __init__(self, engine):
+        with engine.begin() as connection:
+            connection.execute(text(SEARCH_INDEX_DDL))
+
+    def matches(self, selection, term):
+        '''
+        Returns (`selection` filtered to the matches of `term`, rank
+        expression or None when there are no tokens to rank by).
+        '''
+        tokens = tokenize(term)
+        if not tokens:
+            return selection, None
+        document = literal_column(SEARCH_DOCUMENT)
+        query = func.to_tsquery(
+            SEARCH_CONFIG, ' & '.join(f'{token}:*' for token in tokens)
+            )
+        return (selection.filter(document.op('@@')(query)),
+                func.ts_rank(document, query))
+
+    def search(self, term, after, offset, limit):
+        '''
+        Returns ([(id, rank)] of the page, total). `after` is the (rank, id)
+        of the last row of the previous page.
+        '''
+        selection, rank = self.matches(Question.query, term)
+        total = selection.count()
+
+        if rank is None:
+            if after is not None:
+                selection = selection.filter(Question.id > after[1])
+            page = selection.with_entities(Question.id).order_by(
+                Question.id
+                ).offset(offset).limit(limit)
+            return [(question_id, 0) for question_id, in page], total
+
+        if after is not None:
+            # ts_rank is a real, the cursor value only compares equal to it
+            # at that precision
+            value, question_id = after
+            selection = selection.filter(
+                tuple_(-rank, Question.id)
+                > tuple_(-cast(value, REAL), question_id)
+                )
+        page = selection.with_entities(Question.id, rank).order_by(
+            rank.desc(), Question.id
+            ).offset(offset).limit(limit)
+        return [(question_id, value) for question_id, value in page], total
+
+    def stream(self, term, batch_size):
+        '''
+        Returns (total, QuestionRow iterator over every match in rank
+        order), read from a server-side cursor `batch_size` rows at a time.
+        '''
+        selection, rank = self.matches(QuestionRow.query(), term)
+        total = selection.count()
+        ordering = ((rank.desc(), Question.id) if rank is not None
+                    else (Question.id,))
+        rows = selection.order_by(*ordering).yield_per(batch_size)
+        return total, (QuestionRow._make(row) for row in rows)
+
+    def invalidate(self):
+        pass
+
+
+class InvertedIndex:
+    '''
+    Fallback backend: token -> {question id: term frequency} postings with a
+    sorted vocabulary for prefix lookups. Built lazily from a streamed
+    (id, question, answer) projection on the first search.
+    '''
+
+    def __init__(self, engine):
+        self.lock = threading.RLock()
+        self.built = False
+        self.postings = defaultdict(dict)
+        self.vocabulary = []
+        self.documents = {}
+        _inverted_indexes[engine] = self
+
+    def build(self):
+        with self.lock:
+            if self.built:
+                return
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer
+                ).yield_per(1000)
+            for question_id, question, answer in rows:
+                self.add(question_id, question, answer)
+            self.built = True
+
+    def invalidate(self):
+        '''
+        Drops the index after writes that bypass the ORM (bulk imports); the
+        next search rebuilds it.
+        '''
+        with self.lock:
+            self.built = False
+            self.postings.clear()
+            self.vocabulary.clear()
+            self.documents.clear()
+
+    def add(self, question_id, question, answer):
+        with self.lock:
+            self.remove(question_id)
+            tokens = tokenize(question) + tokenize(answer)
+            self.documents[question_id] = tokens
+            for token in tokens:
+                postings = self.postings[token]
+                if not postings:
+                    insort(self.vocabulary, token)
+                postings[question_id] = postings.get(question_id, 0) + 1
+
+    def remove(self, question_id):
+        with self.lock:
+            for token in self.documents.pop(question_id, ()):
+                postings = self.postings[token]
+                postings.pop(question_id, None)
+                if not postings:
+                    del self.postings[token]
+                    del self.vocabulary[
+                        bisect_left(self.vocabulary, token)
+                        ]
+
+    def match(self, prefix):
+        scores = defaultdict(int)
+        position = bisect_left(self.vocabulary, prefix)
+        while (position < len(self.vocabulary)
+               and self.vocabulary[position].startswith(prefix)):
+            for question_id, frequency in self.postings[
+                    self.vocabulary[position]].items():
+                scores[question_id] += frequency
+            position += 1
+        return scores
+
+    def scores(self, term):
+        self.build()
+        with self.lock:
+            tokens = tokenize(term)
+            if not tokens:
+                return dict.fromkeys(self.documents, 0)
+            scores = self.match(tokens[0])
+            for token in tokens[1:]:
+                matches = self.match(token)
+                scores = {
+                    question_id: score + matches[question_id]
+                    for question_id, score in scores.items()
+                    if question_id in matches
+                    }
+            return scores
+
+    def search(self, term, after, offset, limit):
+        scores = self.scores(term)
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))
+        if after is not None:
+            value, question_id = after
+            position = (-value, question_id)
+            ranked = [i for i in ranked if (-scores[i], i) > position]
+
+        page = ranked[offset:offset + limit]
+        return [(i, scores[i]) for i in page], len(scores)
+
+    def stream(self, term, batch_size):
+        '''
+        Returns (total, QuestionRow iterator over every match in rank
+        order), loading the rows `batch_size` ids at a time.
+        '''
+        scores = self.scores(term)
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))
+
+        def rows():
+            for start in range(0, len(ranked), batch_size):
+                batch = ranked[start:start + batch_size]
+                loaded = {
+                    row.id: row for row in QuestionRow.all(
+                        QuestionRow.query().filter(Question.id.in_(batch))
+                        )
+                    }
+                for question_id in batch:
+                    if question_id in loaded:
+                        yield loaded[question_id]
+
+        return len(ranked), rows()
+
+
+_inverted_indexes = weakref.WeakKeyDictionary()
+
+
+def create_search_index(engine):
+    if engine.dialect.name == 'postgresql':
+        return FullTextSearch(engine)
+    return InvertedIndex(engine)
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+def index_question(mapper, connection, target):
+    index = _inverted_indexes.get(connection.engine)
+    if index is not None and index.built:
+        index.add(target.id, target.question, target.answer)
+
+
+@event.listens_for(Question, 'after_delete')
+def unindex_question(mapper, connection, target):
+    index = _inverted_indexes.get(connection.engine)
+    if index is not None and index.built:
+        index.remove(target.id)
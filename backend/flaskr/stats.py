@@ -0,0 +1,117 @@
+import atexit
+import logging
+import threading
+from collections import Counter as Tally
+
+from models import db, Question, QuestionStats, CategoryStats
+
+# ----------------------------------------------------------------------------#
+# ANSWER STATISTICS
+# ----------------------------------------------------------------------------#
+'''
+Write-behind buffer for reported quiz answers. Reports only add to
+in-memory tallies; a background thread flushes them every `interval`
+seconds, or as soon as `size` answers are pending, as one transaction of
+batched upserts into question_stats and category_stats. The thread starts
+with the first report and the buffer is flushed again at interpreter exit,
+so a clean shutdown loses nothing. A failed flush puts its tallies back for
+the next attempt.
+'''
+logger = logging.getLogger(__name__)
+
+
+class AnswerStats:
+
+    def __init__(self, app, interval, size):
+        self.app = app
+        self.interval = interval
+        self.size = size
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.plays = Tally()
+        self.correct = Tally()
+        self.pending = 0
+
+    def record(self, answers):
+        '''
+        Adds `answers`, an iterable of (question id, correct), to the buffer.
+        '''
+        with self.lock:
+            for question_id, correct in answers:
+                self.plays[question_id] += 1
+                self.correct[question_id] += int(correct)
+                self.pending += 1
+            full = self.pending >= self.size
+            if self.thread is None:
+                self.start()
+        if full:
+            self.wake.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing answer statistics failed')
+
+    def take(self):
+        with self.lock:
+            plays, correct = self.plays, self.correct
+            self.plays, self.correct, self.pending = Tally(), Tally(), 0
+        return plays, correct
+
+    def restore(self, plays, correct):
+        with self.lock:
+            self.plays.update(plays)
+            self.correct.update(correct)
+            self.pending += sum(plays.values())
+
+    def flush(self):
+        '''
+        Writes the buffered tallies and returns the number of answers
+        flushed.
+        '''
+        with self.flush_lock:
+            plays, correct = self.take()
+            if not plays:
+                return 0
+            with self.app.app_context():
+                try:
+                    self.write(plays, correct)
+                except Exception:
+                    db.session.rollback()
+                    self.restore(plays, correct)
+                    raise
+            return sum(plays.values())
+
+    def write(self, plays, correct):
+        # answers to questions deleted since they were reported are dropped
+        categories = dict(
+            db.session.query(Question.id, Question.category).filter(
+                Question.id.in_(list(plays))
+                )
+            )
+        category_plays, category_correct = Tally(), Tally()
+        for question_id, category in categories.items():
+            if category is not None:
+                category_plays[category] += plays[question_id]
+                category_correct[category] += correct[question_id]
+
+        QuestionStats.add({
+            question_id: (plays[question_id], correct[question_id])
+            for question_id in categories
+            })
+        CategoryStats.add({
+            category: (category_plays[category], category_correct[category])
+            for category in category_plays
+            })
+        db.session.commit()
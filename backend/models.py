@@ -1,12 +1,45 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import sqlite3
+import time
+from collections import namedtuple
+from sqlalchemy import (
+  Column, String, Integer, ForeignKey, Index, create_engine, event, inspect,
+  text
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = "trivia"
-database_path = "postgres://{}:{}@{}/{}".format('postgres', 'x', 'localhost:5432', database_name)
+database_path = os.environ.get(
+  'DATABASE_URL',
+  "postgres://{}:{}@{}/{}".format('postgres', 'x', 'localhost:5432', database_name)
+)
 
-db = SQLAlchemy()
+'''
+RoutingSession
+    sends statements to the read replica engine stored in
+    `info['read_replica']`, picked once per request so that all of its reads
+    see the same replica lag, and everything else (writes, flushes, unmarked
+    sessions) to the primary. Replicas are the DATABASE_REPLICA_URLS binds
+    collected by setup_db.
+'''
+class RoutingSession(SignallingSession):
+
+  def get_bind(self, mapper=None, clause=None):
+    replica = self.info.get('read_replica')
+    if replica is not None and not self._flushing:
+      return replica
+    return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
 
 '''
 setup_db(app)
@@ -15,9 +48,202 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+      database_path, app.config
+    )
+    replica_keys = []
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for number, url in enumerate(replica_setting(app.config)):
+      replica_keys.append('replica{}'.format(number))
+      binds[replica_keys[-1]] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
     db.app = app
     db.init_app(app)
     db.create_all()
+    upgrade_db()
+    app.extensions['pool_metrics'] = PoolMetrics(db.engine)
+    app.extensions['read_replicas'] = [
+      db.get_engine(app, bind=key) for key in replica_keys
+    ]
+
+'''
+replica_setting(config)
+    DATABASE_REPLICA_URLS from the app config (a list) or the environment
+    (comma separated); empty when reads should stay on the primary.
+'''
+def replica_setting(config):
+  urls = config.get(
+    'DATABASE_REPLICA_URLS', os.environ.get('DATABASE_REPLICA_URLS', '')
+  )
+  if isinstance(urls, str):
+    urls = [url.strip() for url in urls.split(',')]
+  return [url for url in urls if url]
+
+'''
+Engine settings
+    read from the app config, then the environment, then these defaults.
+    DB_STATEMENT_TIMEOUT is in milliseconds, 0 disables it.
+'''
+ENGINE_DEFAULTS = {
+  'DB_POOL_SIZE': 5,
+  'DB_MAX_OVERFLOW': 10,
+  'DB_POOL_TIMEOUT': 30,
+  'DB_POOL_RECYCLE': 1800,
+  'DB_POOL_PRE_PING': True,
+  'DB_STATEMENT_TIMEOUT': 0,
+}
+
+def engine_setting(config, key):
+  default = ENGINE_DEFAULTS[key]
+  value = config.get(key, os.environ.get(key, default))
+  if isinstance(default, bool) and isinstance(value, str):
+    return value.lower() in ('1', 'true', 'yes')
+  return type(default)(value)
+
+def engine_options(database_path, config):
+  if database_path.startswith('sqlite'):
+    # SQLite has no server side pool; an in-memory database must share its
+    # single connection across threads to act as a stand-in for Postgres
+    options = {'connect_args': {'check_same_thread': False}}
+    if database_path in ('sqlite://', 'sqlite:///:memory:'):
+      options['poolclass'] = StaticPool
+    return options
+
+  options = {
+    'pool_size': engine_setting(config, 'DB_POOL_SIZE'),
+    'max_overflow': engine_setting(config, 'DB_MAX_OVERFLOW'),
+    'pool_timeout': engine_setting(config, 'DB_POOL_TIMEOUT'),
+    'pool_recycle': engine_setting(config, 'DB_POOL_RECYCLE'),
+    'pool_pre_ping': engine_setting(config, 'DB_POOL_PRE_PING'),
+  }
+  if database_path.startswith('postgres'):
+    # batch executemany (bulk imports) into multi-row INSERT ... VALUES
+    options['executemany_mode'] = 'values'
+    statement_timeout = engine_setting(config, 'DB_STATEMENT_TIMEOUT')
+    if statement_timeout:
+      options['connect_args'] = {
+        'options': '-c statement_timeout={}'.format(statement_timeout)
+      }
+  return options
+
+'''
+enable_sqlite_foreign_keys
+    SQLite ignores foreign keys unless every connection turns them on, so
+    the stand-in would skip the ON DELETE SET NULL that Category.delete
+    relies on.
+'''
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+  if isinstance(dbapi_connection, sqlite3.Connection):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+'''
+PoolMetrics
+    connection pool checkout counters for the engine, reported with the
+    pool's own size/overflow figures where the pool class has them
+'''
+class PoolMetrics:
+
+  def __init__(self, engine):
+    self.engine = engine
+    self.connects = 0
+    self.checkouts = 0
+    self.checked_out = 0
+    self.peak_checked_out = 0
+    event.listen(engine, 'connect', self.on_connect)
+    event.listen(engine, 'checkout', self.on_checkout)
+    event.listen(engine, 'checkin', self.on_checkin)
+
+  def on_connect(self, dbapi_connection, connection_record):
+    self.connects += 1
+
+  def on_checkout(self, dbapi_connection, connection_record, proxy):
+    self.checkouts += 1
+    self.checked_out += 1
+    self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+  def on_checkin(self, dbapi_connection, connection_record):
+    self.checked_out -= 1
+
+  def status(self):
+    status = {
+      'connects': self.connects,
+      'checkouts': self.checkouts,
+      'checked_out': self.checked_out,
+      'peak_checked_out': self.peak_checked_out,
+    }
+    for name in ('size', 'checkedin', 'overflow'):
+      if hasattr(self.engine.pool, name):
+        status[name] = getattr(self.engine.pool, name)()
+    return status
+
+'''
+upgrade_db()
+    runs at startup in every worker: adds the QUESTION_INDEXES to restored
+    trivia.psql dumps and seeds missing counters. Every step is idempotent.
+
+migrate_db()
+    brings databases created before questions.category became an integer
+    foreign key (String columns from older create_all runs) up to the current
+    schema. It rewrites the questions table, so it runs once from
+    `flask migrate-db` instead of racing in every worker's startup. Category
+    values that name no category are set to NULL before the constraint is
+    added.
+'''
+QUESTION_INDEXES = (
+  ('ix_questions_category_id', ('category', 'id')),
+  ('ix_questions_category_difficulty', ('category', 'difficulty', 'id')),
+  ('ix_questions_category_rating', ('category', 'rating', 'id')),
+  ('ix_questions_difficulty', ('difficulty', 'id')),
+  ('ix_questions_rating', ('rating', 'id')),
+)
+
+def upgrade_db():
+  with db.engine.begin() as connection:
+    for name, columns in QUESTION_INDEXES:
+      connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS {} ON questions ({})".format(
+          name, ', '.join(columns)
+        )
+      ))
+    if Counter.missing(connection):
+      if connection.dialect.name == 'postgresql':
+        # holds off writers that started before their counter rows existed,
+        # their increments would otherwise be lost
+        connection.execute(text(
+          "LOCK TABLE questions, categories IN SHARE MODE"
+        ))
+      Counter.seed(connection)
+
+def migrate_db():
+  with db.engine.begin() as connection:
+    if connection.dialect.name != 'postgresql':
+      return
+    columns = inspect(connection).get_columns('questions')
+    category = next(c for c in columns if c['name'] == 'category')
+    if not isinstance(category['type'], Integer):
+      connection.execute(text(
+        "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+        "USING NULLIF(category, '')::integer"
+      ))
+    if not inspect(connection).get_foreign_keys('questions'):
+      # no category can be deleted or orphan inserted until the constraint
+      # is in place
+      connection.execute(text(
+        "LOCK TABLE questions, categories IN SHARE ROW EXCLUSIVE MODE"
+      ))
+      connection.execute(text(
+        "UPDATE questions SET category = NULL WHERE category IS NOT NULL "
+        "AND NOT EXISTS "
+        "(SELECT 1 FROM categories WHERE categories.id = questions.category)"
+      ))
+      connection.execute(text(
+        "ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY "
+        "(category) REFERENCES categories (id) "
+        "ON UPDATE CASCADE ON DELETE SET NULL"
+      ))
 
 '''
 Question
@@ -25,11 +251,17 @@ Question
 '''
 class Question(db.Model):
   __tablename__ = 'questions'
+  __table_args__ = tuple(
+    Index(name, *columns) for name, columns in QUESTION_INDEXES
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(
+    Integer,
+    ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL')
+  )
   difficulty = Column(Integer)
   rating = Column(Integer)
 
@@ -42,15 +274,29 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
+    Counter.incr_questions(self.category, 1)
+    Counter.bump('questions')
     db.session.commit()
 
   def update(self):
+    Counter.bump('questions')
     db.session.commit()
 
   def delete(self):
     db.session.delete(self)
+    Counter.incr_questions(self.category, -1)
+    Counter.bump('questions')
     db.session.commit()
 
+  @classmethod
+  def count(cls, category=None):
+    if category is None:
+      return Counter.get('questions', cls.query)
+    return Counter.get(
+      Counter.category_name(category),
+      cls.query.filter(cls.category == category)
+    )
+
   def format(self):
     return {
       'id': self.id,
@@ -61,6 +307,45 @@ class Question(db.Model):
       'rating': self.rating
     }
 
+'''
+QuestionRow
+    read-only projection of the question columns for list and quiz
+    endpoints. Plain tuples avoid ORM instances, attribute instrumentation
+    and identity map bookkeeping; format() matches Question.format().
+'''
+class QuestionRow(
+  namedtuple('QuestionRow', 'id question answer category difficulty rating')
+):
+  __slots__ = ()
+
+  @classmethod
+  def columns(cls):
+    return [getattr(Question, field) for field in cls._fields]
+
+  @classmethod
+  def project(cls, selection):
+    return selection.with_entities(*cls.columns())
+
+  @classmethod
+  def query(cls):
+    return db.session.query(*cls.columns())
+
+  @classmethod
+  def all(cls, selection):
+    return [cls._make(row) for row in selection]
+
+  @classmethod
+  def first(cls, selection):
+    row = selection.first()
+    return cls._make(row) if row is not None else None
+
+  @classmethod
+  def get(cls, question_id):
+    return cls.first(cls.query().filter(Question.id == question_id))
+
+  def format(self):
+    return self._asdict()
+
 '''
 Category
 
@@ -76,17 +361,202 @@ class Category(db.Model):
 
   def insert(self):
     db.session.add(self)
+    db.session.flush()
+    db.session.add(Counter(name=Counter.category_name(self.id), value=0))
+    Counter.incr('categories', 1)
+    Counter.bump('categories')
     db.session.commit()
 
   def update(self):
+    Counter.bump('categories')
     db.session.commit()
 
   def delete(self):
     db.session.delete(self)
+    Counter.query.filter(
+      Counter.name == Counter.category_name(self.id)
+    ).delete(synchronize_session=False)
+    Counter.incr('categories', -1)
+    Counter.bump('categories')
+    # the foreign key sets the category of its questions to NULL
+    Counter.bump('questions')
     db.session.commit()
 
+  @classmethod
+  def count(cls):
+    return Counter.get('categories', cls.query)
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+Counter
+    running question totals, overall and per category, and the category
+    total, updated in the same
+    transaction as Question.insert/delete so that list endpoints read one
+    row instead of counting the questions table. Missing counters are
+    seeded from SELECT count(*) by upgrade_db at startup (which only locks
+    the tables when a counter is missing), and a category's
+    counter is created with the category, so every write finds its row.
+
+    `version:<resource>` counters are bumped on every write to questions or
+    categories and serve as cheap version tokens for HTTP validators.
+'''
+COUNTER_SEEDS = (
+  "INSERT INTO counters (name, value) "
+  "SELECT 'questions', (SELECT count(*) FROM questions) "
+  "WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'questions') "
+  "ON CONFLICT (name) DO NOTHING",
+  "INSERT INTO counters (name, value) "
+  "SELECT 'categories', (SELECT count(*) FROM categories) "
+  "WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'categories') "
+  "ON CONFLICT (name) DO NOTHING",
+  # versions start from the clock so a recreated database never hands out
+  # a token that a client cached before
+  "INSERT INTO counters (name, value) "
+  "SELECT 'version:questions', :now "
+  "WHERE NOT EXISTS "
+  "(SELECT 1 FROM counters WHERE name = 'version:questions') "
+  "ON CONFLICT (name) DO NOTHING",
+  "INSERT INTO counters (name, value) "
+  "SELECT 'version:categories', :now "
+  "WHERE NOT EXISTS "
+  "(SELECT 1 FROM counters WHERE name = 'version:categories') "
+  "ON CONFLICT (name) DO NOTHING",
+)
+CATEGORY_COUNTER_SEED = (
+  "INSERT INTO counters (name, value) "
+  "SELECT 'questions:category:' || CAST(categories.id AS VARCHAR), "
+  "(SELECT count(*) FROM questions "
+  "WHERE questions.category = categories.id) "
+  "FROM categories WHERE NOT EXISTS (SELECT 1 FROM counters WHERE "
+  "counters.name = 'questions:category:' || CAST(categories.id AS VARCHAR)) "
+  "ON CONFLICT (name) DO NOTHING"
+)
+COUNTERS_MISSING = (
+  "SELECT (SELECT count(*) FROM counters WHERE name IN ("
+  "'questions', 'categories', 'version:questions', 'version:categories'"
+  ")) < 4 OR EXISTS (SELECT 1 FROM categories WHERE NOT EXISTS ("
+  "SELECT 1 FROM counters WHERE "
+  "counters.name = 'questions:category:' || CAST(categories.id AS VARCHAR)))"
+)
+
+class Counter(db.Model):
+  __tablename__ = 'counters'
+
+  name = Column(String, primary_key=True)
+  value = Column(Integer, nullable=False, default=0)
+
+  @staticmethod
+  def category_name(category):
+    return 'questions:category:{}'.format(category)
+
+  @staticmethod
+  def missing(connection):
+    return bool(connection.execute(text(COUNTERS_MISSING)).scalar())
+
+  @staticmethod
+  def seed(connection):
+    for statement in COUNTER_SEEDS:
+      connection.execute(text(statement), {'now': int(time.time())})
+    Counter.seed_categories(connection)
+
+  @staticmethod
+  def seed_categories(connection):
+    connection.execute(text(CATEGORY_COUNTER_SEED))
+
+  @classmethod
+  def get(cls, name, selection=None):
+    counter = cls.query.get(name)
+    if counter is not None:
+      return counter.value
+    # only reachable for a category id that does not exist
+    if selection is not None:
+      return selection.order_by(None).count()
+    return 0
+
+  @classmethod
+  def incr(cls, name, delta):
+    cls.query.filter(cls.name == name).update(
+      {cls.value: cls.value + delta}, synchronize_session=False
+    )
+
+  @classmethod
+  def version(cls, resource):
+    return cls.get('version:' + resource)
+
+  @classmethod
+  def bump(cls, resource):
+    cls.incr('version:' + resource, 1)
+
+  @classmethod
+  def incr_questions(cls, category, delta):
+    cls.incr('questions', delta)
+    cls.incr(cls.category_name(category), delta)
+'''
+QuestionStats / CategoryStats
+    play and correct answer totals per question and per category. They are
+    written in batches by the answer statistics buffer (flaskr/stats.py)
+    with upserts that add to the stored totals, so reads are a primary key
+    lookup or a scan of the small category table.
+'''
+STATS_UPSERT = (
+  "INSERT INTO {table} ({key}, plays, correct) "
+  "VALUES (:key, :plays, :correct) "
+  "ON CONFLICT ({key}) DO UPDATE SET "
+  "plays = {table}.plays + excluded.plays, "
+  "correct = {table}.correct + excluded.correct"
+)
+
+class AnswerTotals:
+  plays = Column(Integer, nullable=False, default=0)
+  correct = Column(Integer, nullable=False, default=0)
+
+  @classmethod
+  def add(cls, totals):
+    '''
+    adds {key: (plays, correct)} to the stored totals, creating missing
+    rows (ON CONFLICT upserts need SQLite 3.24+ or Postgres 9.5+)
+    '''
+    if not totals:
+      return
+    # sorted so concurrent flushes from several workers lock rows in the
+    # same order
+    db.session.execute(
+      text(STATS_UPSERT.format(table=cls.__tablename__, key=cls.key_name)),
+      [
+        {'key': key, 'plays': plays, 'correct': correct}
+        for key, (plays, correct) in sorted(totals.items())
+      ]
+    )
+
+  def format(self):
+    return {
+      self.key_name: getattr(self, self.key_name),
+      'plays': self.plays,
+      'correct': self.correct,
+      'accuracy': self.correct / self.plays if self.plays else None
+    }
+
+class QuestionStats(AnswerTotals, db.Model):
+  __tablename__ = 'question_stats'
+  key_name = 'question_id'
+
+  question_id = Column(
+    Integer,
+    ForeignKey('questions.id', ondelete='CASCADE'),
+    primary_key=True
+  )
+
+class CategoryStats(AnswerTotals, db.Model):
+  __tablename__ = 'category_stats'
+  key_name = 'category_id'
+
+  category_id = Column(
+    Integer,
+    ForeignKey('categories.id', ondelete='CASCADE'),
+    primary_key=True
+  )
@@ -1,10 +1,15 @@
 import os
+import gzip
+import threading
+import time
 import unittest
+from unittest import mock
 import json
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import db, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,20 +17,19 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = "trivia_test"
-        self.database_path = "postgres://{}:{}@{}/{}".format(
-            'postgres', 'x', 'localhost:5432', self.database_name
+        self.database_path = os.environ.get(
+            'TEST_DATABASE_URL', "postgres://{}:{}@{}/{}".format(
+                'postgres', 'x', 'localhost:5432', self.database_name
+                )
             )
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'QUERY_BUDGET': 8,
+            'ROW_BUDGET': 100,
+            'ENFORCE_QUERY_BUDGET': True
+            })
+        self.client = self.app.test_client
 
     def tearDown(self):
         """Executed after reach test"""
@@ -38,6 +42,237 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['categories']))
 
+    def test_get_health(self):
+        self.client().get('/questions')
+        res = self.client().get('/health')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['pool']['checkouts'])
+
+    def test_get_metrics(self):
+        res = self.client().get('/questions')
+        self.assertIn('db;dur=', res.headers['Server-Timing'])
+
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'trivia_request_duration_seconds_count{route="get_questions"} 1',
+            body
+            )
+        self.assertIn('trivia_cache_misses_total{cache="categories"}', body)
+        self.assertIn('trivia_db_pool_checkouts', body)
+
+    def test_concurrent_reads_coalesced(self):
+        started, release = threading.Event(), threading.Event()
+
+        def block_first_read(conn, cursor, statement, *args):
+            if 'FROM questions' in statement and not started.is_set():
+                started.set()
+                release.wait(5)
+
+        responses = []
+
+        def get_page():
+            res = self.client().get('/categories/1/questions')
+            responses.append((res.status_code, res.data))
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', block_first_read)
+        try:
+            leader = threading.Thread(target=get_page)
+            leader.start()
+            started.wait(5)
+            followers = [threading.Thread(target=get_page) for _ in range(3)]
+            for follower in followers:
+                follower.start()
+            # let the followers reach the in-flight request
+            time.sleep(0.2)
+            release.set()
+            for thread in [leader] + followers:
+                thread.join()
+        finally:
+            event.remove(engine, 'before_cursor_execute', block_first_read)
+
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(len(set(responses)), 1)
+        self.assertEqual(responses[0][0], 200)
+
+        body = self.client().get('/metrics').data.decode()
+        self.assertIn(
+            'trivia_coalesced_requests_total'
+            '{route="get_questions_by_category"} 3', body
+            )
+
+    def test_429_rate_limit(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'RATE_LIMIT': 0.1,
+            'RATE_LIMIT_BURST': 2
+            })
+        client = app.test_client()
+
+        for _ in range(2):
+            self.assertEqual(client.get('/categories').status_code, 200)
+        res = client.get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Rate limit exceeded')
+        self.assertEqual(res.headers['Retry-After'], '10')
+        self.assertEqual(client.get('/health').status_code, 200)
+
+    def test_503_route_concurrency_limit(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'ROUTE_CONCURRENCY': {'search_questions': 0, 'play_quiz': 1}
+            })
+        client = app.test_client()
+
+        res = client.post('/search', json={'searchTerm': 'what'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertIn('trivia_shed_requests_total{route="search_questions"} 1',
+                      client.get('/metrics').data.decode())
+
+        # the slot is given back once a request is done
+        for _ in range(2):
+            res = client.post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 0, 'type': 'All'}
+            })
+            self.assertEqual(res.status_code, 200)
+
+    def test_suite_requests_count_against_budget(self):
+        res = self.client().get('/questions')
+        queries = int(
+            res.headers['Server-Timing'].split('desc="')[1].split(' ')[0]
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(queries, 0)
+        self.assertLessEqual(queries, 8)
+
+    def test_500_query_budget_exceeded(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'QUERY_BUDGET': 1,
+            'ENFORCE_QUERY_BUDGET': True
+            })
+        res = app.test_client().get('/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(data['success'], False)
+        self.assertIn('Query budget exceeded', data['message'])
+        self.assertEqual(res.headers['Access-Control-Allow-Origin'], '*')
+
+    def test_slow_query_logs_plan(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SLOW_QUERY_MS': 0
+            })
+        with self.assertLogs('flaskr.budget', level='WARNING') as logs:
+            res = app.test_client().get('/categories/1/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(any('Slow statement' in line for line in logs.output))
+
+    def test_startup_skips_seeded_counters(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+
+        self.assertTrue(statements)
+        self.assertFalse([statement for statement in statements
+                          if 'LOCK TABLE' in statement
+                          or 'INSERT INTO counters' in statement])
+
+    def test_migrate_db_clears_orphaned_categories(self):
+        with self.app.app_context():
+            if db.engine.dialect.name != 'postgresql':
+                self.skipTest('migrate-db only changes Postgres schemas')
+            db.session.execute(
+                'ALTER TABLE questions DROP CONSTRAINT category'
+                )
+            question_id = db.session.execute(
+                "INSERT INTO questions (question, answer, category) "
+                "VALUES ('orphan', 'a', 100000) RETURNING id"
+                ).scalar()
+            db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=['migrate-db'])
+
+        self.assertEqual(result.exit_code, 0)
+        with self.app.app_context():
+            self.assertIsNone(Question.query.get(question_id).category)
+            self.assertTrue(inspect(db.engine).get_foreign_keys('questions'))
+            db.session.execute(
+                'DELETE FROM questions WHERE id = :id', {'id': question_id}
+                )
+            db.session.commit()
+
+    def test_reads_routed_to_replica(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'DATABASE_REPLICA_URLS': [self.database_path]
+            })
+        statements = []
+        event.listen(
+            app.extensions['read_replicas'][0], 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement)
+            )
+        client = app.test_client()
+
+        res = client.get('/questions')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(statements)
+
+        res = client.post('/categories', json={'type': 'replica'})
+        self.assertIn('read_primary_until', res.headers['Set-Cookie'])
+
+        del statements[:]
+        res = client.get('/questions')
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(statements)
+
+    def test_request_reads_from_one_replica(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'DATABASE_REPLICA_URLS': [self.database_path] * 2
+            })
+        hits = []
+        for number, engine in enumerate(app.extensions['read_replicas']):
+            event.listen(
+                engine, 'before_cursor_execute',
+                lambda conn, cursor, statement, *args, number=number:
+                    hits.append(number)
+                )
+        client = app.test_client()
+
+        used = set()
+        for page in range(1, 21):
+            del hits[:]
+            res = client.get(f'/questions?page={page % 2 + 1}')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(len(set(hits)), 1)
+            used.update(hits)
+        self.assertEqual(used, {0, 1})
+
     def test_post_category(self):
         post_data = {
             'type': 'a'
@@ -49,6 +284,83 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
 
 
+    def test_get_categories_after_post_category(self):
+        self.client().get('/categories')
+        res = self.client().post('/categories', json={'type': 'b'})
+        created = json.loads(res.data)['created']
+
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'][str(created)], 'b')
+
+    def test_new_category_counts_questions_without_seeding(self):
+        res = self.client().post('/categories', json={'type': 'counted'})
+        category_id = json.loads(res.data)['created']
+        self.client().post('/questions', json={
+            'question': 'a',
+            'answer': 'a',
+            'category': category_id,
+            'difficulty': 1,
+            'rating': 1
+        })
+
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+        record = (lambda conn, cursor, statement, *args:
+                  statements.append(statement))
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().get(f'/categories/{category_id}/questions')
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertFalse([statement for statement in statements
+                          if not statement.lstrip().startswith('SELECT')])
+
+    def test_get_categories_after_post_category_on_other_worker(self):
+        other = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        other.test_client().get('/categories')
+
+        res = self.client().post('/categories', json={'type': 'elsewhere'})
+        created = json.loads(res.data)['created']
+
+        res = other.test_client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'][str(created)], 'elsewhere')
+        self.assertEqual(res.headers['ETag'],
+                         self.client().get('/categories').headers['ETag'])
+
+    def test_question_payloads_after_delete_category_on_other_worker(self):
+        res = self.client().post('/categories', json={'type': 'doomed'})
+        category_id = json.loads(res.data)['created']
+        self.client().post('/questions', json={
+            'question': 'a',
+            'answer': 'a',
+            'category': category_id,
+            'difficulty': 1,
+            'rating': 1
+        })
+        other = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        question = json.loads(other.test_client().get(
+            '/questions?sort=-id'
+            ).data)['questions'][0]
+        self.assertEqual(question['category'], category_id)
+
+        self.client().delete(f'/categories/{category_id}')
+        res = other.test_client().get('/questions?sort=-id')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['questions'][0]['id'], question['id'])
+        self.assertIsNone(data['questions'][0]['category'])
+
     def test_400_post_category(self):
         res = self.client().post('/categories', json={})
         data = json.loads(res.data)
@@ -87,6 +399,126 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(len(data['categories']))
 
+    def test_get_questions_filtered(self):
+        res = self.client().get('/questions?difficulty=2&min_rating=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(q['difficulty'] == 2 for q in data['questions']))
+        self.assertLess(data['total_questions'],
+                        json.loads(self.client().get('/questions').data)[
+                            'total_questions'])
+
+    def test_get_questions_sorted_by_rating_with_cursor(self):
+        total = json.loads(self.client().get('/questions').data)[
+            'total_questions']
+        seen = []
+        url = '/questions?sort=-rating'
+        while url:
+            data = json.loads(self.client().get(url).data)
+            seen += [(q['rating'], q['id']) for q in data.get('questions', [])]
+            cursor = data.get('next_cursor')
+            url = cursor and f'/questions?sort=-rating&after={cursor}'
+
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), total)
+
+    def test_get_questions_sorted_with_null_ratings(self):
+        res = self.client().post('/categories', json={'type': 'unrated'})
+        category_id = json.loads(res.data)['created']
+        with self.app.app_context():
+            for number in range(13):
+                Question(
+                    question=f'unrated {number}', answer='a',
+                    category=category_id, difficulty=1,
+                    rating=None if number % 2 else number
+                    ).insert()
+
+        for sort in ('rating', '-rating'):
+            seen = []
+            url = f'/categories/{category_id}/questions?sort={sort}'
+            while url:
+                res = self.client().get(url)
+                self.assertEqual(res.status_code, 200)
+                data = json.loads(res.data)
+                seen += [(q['rating'], q['id']) for q in data['questions']]
+                cursor = data['next_cursor']
+                url = cursor and (f'/categories/{category_id}/questions'
+                                  f'?sort={sort}&after={cursor}')
+
+            # NULLs order after every rating
+            expected = sorted(
+                seen, key=lambda row: (row[0] is None, row[0] or 0, row[1])
+                )
+            if sort.startswith('-'):
+                expected.reverse()
+            self.assertEqual(seen, expected)
+            self.assertEqual(len(seen), 13)
+
+    def test_422_get_questions_by_category_unsupported_sort(self):
+        res = self.client().get('/categories/1/questions?sort=answer')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_get_questions_gzip(self):
+        res = self.client().get(
+            '/questions', headers={'Accept-Encoding': 'gzip'}
+            )
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(data['success'], True)
+
+        res = self.client().get('/questions', headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': res.headers['ETag']
+            })
+        self.assertEqual(res.status_code, 304)
+
+    def test_304_get_questions_if_none_match(self):
+        res = self.client().get('/questions')
+        etag = res.headers['ETag']
+
+        res = self.client().get(
+            '/questions', headers={'If-None-Match': etag}
+            )
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_get_questions_etag_changes_after_post_question(self):
+        res = self.client().get('/questions')
+        etag = res.headers['ETag']
+
+        post_data = {
+            'question': 'a',
+            'answer': 'a',
+            'category': 1,
+            'difficulty': 3,
+            'rating': 5
+        }
+        self.client().post('/questions', json=post_data)
+        res = self.client().get(
+            '/questions', headers={'If-None-Match': etag}
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_get_questions_repeated_from_payload_cache(self):
+        first = json.loads(self.client().get('/questions').data)
+        second = json.loads(self.client().get('/questions').data)
+
+        self.assertEqual(first, second)
+        self.assertEqual(
+            set(second['questions'][0]),
+            {'id', 'question', 'answer', 'category', 'difficulty', 'rating'}
+            )
+
     def test_404_sent_requesting_beyond_valid_page(self):
         res = self.client().get('/questions?page=1000')
         data = json.loads(res.data)
@@ -95,7 +527,53 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Questions not found')
 
+    def test_get_questions_after_cursor(self):
+        res = self.client().get('/questions')
+        first_page = json.loads(res.data)
+        cursor = first_page['next_cursor']
+
+        res = self.client().get(f'/questions?after={cursor}')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(
+            data['questions'][0]['id'] > first_page['questions'][-1]['id']
+            )
+
+    def test_422_sent_requesting_invalid_list_arguments(self):
+        for query in ('after=not-a-cursor', 'difficulty=hard',
+                      'min_rating=high', 'sort=answer',
+                      'sort=rating&after=not-a-cursor'):
+            for route in ('/questions', '/categories/1/questions'):
+                res = self.client().get(f'{route}?{query}')
+                data = json.loads(res.data)
+
+                self.assertEqual(res.status_code, 422)
+                self.assertEqual(data['success'], False)
+                self.assertEqual(data['message'], 'unprocessable')
+
     def test_post_question(self):
+        post_data = {
+            'question': 'a',
+            'answer': 'a',
+            'category': 1,
+            'difficulty': 3,
+            'rating': 5
+        }
+        res = self.client().post('/questions', json=post_data)
+        data = json.loads(res.data)
+        listed = [(q['category'], q['id']) for q in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(listed, sorted(listed))
+
+    def test_post_question_updates_total_questions(self):
+        res = self.client().get('/questions')
+        total = json.loads(res.data)['total_questions']
+
         post_data = {
             'question': 'a',
             'answer': 'a',
@@ -106,8 +584,25 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/questions', json=post_data)
         data = json.loads(res.data)
 
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_question'], total + 1)
+
+    def test_post_question_lean(self):
+        post_data = {
+            'question': 'a',
+            'answer': 'a',
+            'category': 1,
+            'difficulty': 3,
+            'rating': 5
+        }
+        res = self.client().post('/questions?lean=true', json=post_data)
+        data = json.loads(res.data)
+
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], data['created'])
+        self.assertTrue(data['total_question'])
+        self.assertNotIn('questions', data)
 
     def test_400_post_question(self):
         res = self.client().post('/questions', json={})
@@ -137,6 +632,86 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Question with id:1000 not found')
 
+    def test_import_questions(self):
+        rows = '\n'.join(json.dumps({
+            'question': f'imported {i}',
+            'answer': 'a',
+            'category': 1,
+            'difficulty': 1,
+            'rating': 1
+        }) for i in range(3))
+        res = self.client().post(
+            '/questions/import', data=rows,
+            content_type='application/x-ndjson'
+            )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['imported'], 3)
+
+    def test_422_import_questions_missing_keys(self):
+        res = self.client().post(
+            '/questions/import', data='{"question": "a"}\n',
+            content_type='application/x-ndjson'
+            )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(
+            data['message'],
+            'Line 1: Required object keys missing from row (0 rows imported)'
+            )
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(rows))
+        self.assertEqual(rows, sorted(rows, key=lambda row: row['id']))
+
+    def test_export_import_round_trip_with_nulls(self):
+        with self.app.app_context():
+            question = Question(
+                question='uncategorised', answer='a', category=None,
+                difficulty=None, rating=None
+                )
+            question.insert()
+            question_id = question.id
+
+        for output_format, content_type in (('ndjson', 'application/x-ndjson'),
+                                            ('csv', 'text/csv')):
+            res = self.client().get(f'/questions/export?format={output_format}')
+            lines = res.data.decode().splitlines(keepends=True)
+            header = lines[:1] if output_format == 'csv' else []
+            exported = [line for line in lines
+                        if line.startswith((f'{question_id},',
+                                            f'{{"id": {question_id},'))]
+            self.assertEqual(len(exported), 1)
+
+            with self.app.app_context():
+                Question.query.get(question_id).delete()
+            res = self.client().post(
+                '/questions/import', data=''.join(header + exported),
+                content_type=content_type
+                )
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['imported'], 1)
+            with self.app.app_context():
+                question = Question.query.get(question_id)
+                self.assertEqual(
+                    (question.category, question.difficulty, question.rating),
+                    (None, None, None)
+                    )
+
+        with self.app.app_context():
+            Question.query.get(question_id).delete()
+
     def test_get_questions_by_category(self):
         res = self.client().get('/categories/1/questions')
         data = json.loads(res.data)
@@ -169,6 +744,36 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_post_search_matches_answer(self):
+        search_term = {"searchTerm": "angelou"}
+        res = self.client().post('/search', json=search_term)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        self.assertEqual(data['questions'][0]['answer'], 'Maya Angelou')
+
+    def test_post_search_stream(self):
+        res = self.client().post(
+            '/search?stream=true', json={'searchTerm': 'title'}
+            )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['total_questions'])
+        self.assertEqual(len(data['questions']), data['total_questions'])
+
+    def test_post_search_stream_gzip(self):
+        res = self.client().post(
+            '/search?stream=true', json={'searchTerm': ''},
+            headers={'Accept-Encoding': 'gzip'}
+            )
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(data['questions']), data['total_questions'])
+
     def test_422_post_paginated_search_question(self):
         res = self.client().post('/search')
         data = json.loads(res.data)
@@ -177,6 +782,38 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'],"unprocessable")
 
+    def test_post_search_cursor_follows_rank_order(self):
+        search_term = {'searchTerm': 'a'}
+        res = self.client().post('/search', json=search_term)
+        data = json.loads(res.data)
+        total = data['total_questions']
+
+        by_cursor = [question['id'] for question in data['questions']]
+        while data.get('next_cursor'):
+            res = self.client().post(
+                f"/search?after={data['next_cursor']}", json=search_term
+                )
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            by_cursor += [question['id'] for question in data['questions']]
+
+        by_page = []
+        for page in range(1, (total + 9) // 10 + 1):
+            res = self.client().post(f'/search?page={page}', json=search_term)
+            by_page += [q['id'] for q in json.loads(res.data)['questions']]
+
+        self.assertGreater(total, 10)
+        self.assertEqual(len(set(by_cursor)), total)
+        self.assertEqual(by_cursor, by_page)
+
+    def test_422_post_search_invalid_cursor(self):
+        res = self.client().post('/search?after=garbage',
+                                 json={'searchTerm': 'what'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_404_post_paginated_search_question(self):
         search_term = {"searchTerm": "blahblahblahblah"}
         res = self.client().post('/search', json=search_term)
@@ -206,6 +843,250 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def category_question_ids(self, category_id):
+        question_ids = []
+        url = f'/categories/{category_id}/questions'
+        while url:
+            data = json.loads(self.client().get(url).data)
+            question_ids += [q['id'] for q in data.get('questions', [])]
+            cursor = data.get('next_cursor')
+            url = cursor and (
+                f'/categories/{category_id}/questions?after={cursor}'
+                )
+        return question_ids
+
+    def test_post_play_quiz_skips_previous_questions(self):
+        question_ids = self.category_question_ids(1)
+
+        test_quiz = {
+            'previous_questions': question_ids[1:],
+            'quiz_category': {'id': '1', 'type': 'Science'}
+        }
+        res = self.client().post('/quizzes', json=test_quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], question_ids[0])
+
+    def test_post_play_quiz_when_category_exhausted(self):
+        question_ids = self.category_question_ids(1)
+
+        test_quiz = {
+            'previous_questions': question_ids,
+            'quiz_category': {'id': '1', 'type': 'Science'}
+        }
+        res = self.client().post('/quizzes', json=test_quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question'], None)
+
+    def test_post_play_quiz_count(self):
+        question_ids = self.category_question_ids(1)
+
+        test_quiz = {
+            'previous_questions': question_ids[:1],
+            'quiz_category': {'id': '1', 'type': 'Science'},
+            'count': len(question_ids)
+        }
+        res = self.client().post('/quizzes', json=test_quiz)
+        data = json.loads(res.data)
+        drawn = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(drawn), sorted(question_ids[1:]))
+        self.assertEqual(data['question']['id'], drawn[0])
+
+    def test_post_play_quiz_count_without_decks(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'QUIZ_DECKS': False
+            })
+        res = app.test_client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 0, 'type': 'All'},
+            'count': 3
+        })
+        data = json.loads(res.data)
+        drawn = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(set(drawn)), 3)
+
+    def test_422_post_play_quiz_count_out_of_range(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 0, 'type': 'All'},
+            'count': 0
+        })
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_quiz_deck_follows_insert_and_delete(self):
+        res = self.client().post('/categories', json={'type': 'dealt'})
+        category_id = json.loads(res.data)['created']
+        quiz = {'previous_questions': [],
+                'quiz_category': {'id': category_id, 'type': 'dealt'}}
+        res = self.client().post('/quizzes', json=quiz)
+        self.assertIsNone(json.loads(res.data)['question'])
+
+        res = self.client().post('/questions', json={
+            'question': 'a',
+            'answer': 'a',
+            'category': category_id,
+            'difficulty': 1,
+            'rating': 1
+        })
+        question_id = json.loads(res.data)['created']
+        decks = self.app.extensions['quiz_decks']
+        with self.app.app_context():
+            self.assertIn(question_id, decks.deck(category_id))
+            self.assertIn(question_id, decks.deck(0))
+        res = self.client().post('/quizzes', json=quiz)
+        self.assertEqual(json.loads(res.data)['question']['id'], question_id)
+
+        self.client().delete(f'/questions/{question_id}')
+        with self.app.app_context():
+            self.assertNotIn(question_id, decks.deck(category_id))
+            self.assertNotIn(question_id, decks.deck(0))
+        res = self.client().post('/quizzes', json=quiz)
+        self.assertIsNone(json.loads(res.data)['question'])
+
+    def test_quiz_deck_walks_exhausted_deck(self):
+        question_ids = self.category_question_ids(1)
+        decks = self.app.extensions['quiz_decks']
+        with self.app.app_context():
+            # more than are left, so the random draws give way to the walk
+            drawn = decks.draw_many(1, question_ids[1:], 2)
+            self.assertEqual(drawn, question_ids[:1])
+            self.assertEqual(decks.draw_many(1, question_ids, 1), [])
+            self.assertIsNone(decks.draw(1, question_ids))
+
+    def test_quiz_deck_draw_holds_off_concurrent_remove(self):
+        decks = self.app.extensions['quiz_decks']
+        with self.app.app_context():
+            deck = decks.deck(0)
+        last = deck[-1]
+        removers = []
+
+        def randrange(stop):
+            # a delete lands between reading the deck length and the slot
+            remover = threading.Thread(target=decks.remove, args=(last,))
+            remover.start()
+            remover.join(0.1)
+            removers.append(remover)
+            return stop - 1
+
+        with mock.patch('flaskr.decks.random.randrange', randrange):
+            drawn = decks.draw_many(0, [], 1)
+        for remover in removers:
+            remover.join()
+
+        self.assertEqual(drawn, [last])
+        self.assertNotIn(last, deck)
+
+    def test_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'id': '1', 'type': 'Science'}
+        })
+        session = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+
+        seen = []
+        for _ in range(session['total_questions']):
+            res = self.client().post(
+                f"/quizzes/sessions/{session['session']}/next"
+                )
+            seen.append(json.loads(res.data)['question']['id'])
+        res = self.client().post(f"/quizzes/sessions/{session['session']}/next")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question'], None)
+        self.assertEqual(sorted(seen), sorted(self.category_question_ids(1)))
+
+        res = self.client().delete(f"/quizzes/sessions/{session['session']}")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['answered'], session['total_questions'])
+
+    def test_quiz_session_size(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'id': '1', 'type': 'Science'},
+            'size': 2
+        })
+        self.assertEqual(json.loads(res.data)['total_questions'], 2)
+
+    def test_quiz_session_size_capped(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'QUIZ_SESSION_MAX_SIZE': 3
+            })
+        client = app.test_client()
+        all_categories = {'quiz_category': {'id': 0, 'type': 'All'}}
+
+        res = client.post('/quizzes/sessions', json=all_categories)
+        self.assertEqual(json.loads(res.data)['total_questions'], 3)
+
+        res = client.post('/quizzes/sessions',
+                          json=dict(all_categories, size=4))
+        self.assertEqual(res.status_code, 422)
+
+    def test_422_quiz_session_invalid_size(self):
+        for size in (-1, 0, 'all', True):
+            res = self.client().post('/quizzes/sessions', json={
+                'quiz_category': {'id': '1', 'type': 'Science'},
+                'size': size
+            })
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data['success'], False)
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Quiz session not found')
+
+    def test_answer_stats(self):
+        question_id = self.category_question_ids(1)[0]
+        before = json.loads(
+            self.client().get(f'/questions/{question_id}/stats').data
+            )['stats']
+
+        res = self.client().post('/quizzes/answers', json={
+            'answers': [
+                {'question_id': question_id, 'correct': True},
+                {'question_id': question_id, 'correct': False}
+            ]
+        })
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data['recorded'], 2)
+
+        self.app.extensions['answer_stats'].flush()
+        res = self.client().get(f'/questions/{question_id}/stats')
+        stats = json.loads(res.data)['stats']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(stats['plays'], before['plays'] + 2)
+        self.assertEqual(stats['correct'], before['correct'] + 1)
+
+        res = self.client().get('/categories/stats')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(1, [stats['category_id'] for stats in data['stats']])
+
+    def test_400_post_answers_missing_keys(self):
+        res = self.client().post('/quizzes/answers', json={'correct': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_422_post_play_quiz(self):
         res = self.client().post('/quizzes')
         data = json.loads(res.data)
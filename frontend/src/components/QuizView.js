@@ -15,6 +15,7 @@ class QuizView extends Component {
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
+        upcomingQuestions: [],
         guess: '',
         forceEnd: false
     }
@@ -47,6 +48,19 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    // the rest of the round was fetched with the first question
+    if(this.state.upcomingQuestions.length) {
+      const [question, ...upcomingQuestions] = this.state.upcomingQuestions
+      this.setState({
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        currentQuestion: question,
+        upcomingQuestions: upcomingQuestions,
+        guess: ''
+      })
+      return;
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: "POST",
@@ -54,19 +68,22 @@ class QuizView extends Component {
       contentType: 'application/json',
       data: JSON.stringify({
         previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        quiz_category: this.state.quizCategory,
+        count: Math.max(questionsPerPlay - previousQuestions.length, 1)
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
+        const [question = null, ...upcomingQuestions] = result.questions
         this.setState({
           showAnswer: false,
           previousQuestions: previousQuestions,
-          currentQuestion: result.question,
+          currentQuestion: question,
+          upcomingQuestions: upcomingQuestions,
           guess: '',
-          forceEnd: result.question ? false : true
+          forceEnd: question ? false : true
         })
         return;
       },
@@ -94,6 +111,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
       forceEnd: false
     })